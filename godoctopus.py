@@ -1,38 +1,143 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
 import collections.abc
+import concurrent.futures
+import contextlib
 import dataclasses
 import datetime as dt
+import functools
+import io
+import itertools
 import json
 import logging
+import math
+import mmap
 import os
 import pathlib
+import posixpath
+import random
 import re
 import shutil
+import struct
 import subprocess
 import tempfile
+import threading
+import time
 import zipfile
 from hashlib import sha256
-from typing import Any, Iterator, Self
-from urllib.parse import quote
+from typing import IO, Any, Callable, Iterator, Self
+from urllib.parse import parse_qs, quote, urlencode, urlsplit
 
 import jinja2
 import requests
+import requests.adapters
 import requests_cache
 
 API = "https://api.github.com"
+GRAPHQL_API = f"{API}/graphql"
 
 STATUSES_FILE = pathlib.Path(__file__).parent / "statuses.json"
+# Where the site is assembled, beside a manifest with the same name plus .json
+DEFAULT_SITE_DIR = pathlib.Path(__file__).parent / "_build"
 COMMENT_TAG = "<!--amalgamate-pages-->"
 STATUS_CONTEXT = "Publish Web Build"
 STATUS_SUCCESS_DESCRIPTION = "Test this branch"
 
+# Artifacts cannot outlive the repository's retention period, which is 90 days
+# unless configured otherwise.
+DEFAULT_ARTIFACT_RETENTION = dt.timedelta(days=90)
+# A workflow run can be re-run for up to 30 days after it was first created, so
+# its artifact may be up to this much younger than the run itself.
+RERUN_WINDOW = dt.timedelta(days=30)
+
+# How long to cache GitHub API responses, by URL pattern; the first match
+# applies. Other responses are cached for a minute. Once a cached response
+# expires it is revalidated with a conditional request.
+CACHE_POLICY: requests_cache.ExpirationPatterns = {
+    # A re-run keeps its run's ID but may replace its artifacts, so these are
+    # revalidated; find_run_artifact() caches them forever once the run is too
+    # old to be re-run. Otherwise they never change, except that they expire,
+    # which find_artifact() works out for itself.
+    "api.github.com/repos/*/actions/runs/*/artifacts": (
+        requests_cache.EXPIRE_IMMEDIATELY
+    ),
+    # Only changes if an administrator changes the setting.
+    "api.github.com/repos/*/actions/permissions/artifact-and-log-retention": (
+        dt.timedelta(days=1)
+    ),
+    # These change with every push, build or pull request.
+    "api.github.com/repos/*/branches": requests_cache.EXPIRE_IMMEDIATELY,
+    "api.github.com/repos/*/pulls": requests_cache.EXPIRE_IMMEDIATELY,
+    "api.github.com/repos/*/commits/*/status": requests_cache.EXPIRE_IMMEDIATELY,
+    "api.github.com/repos/*/actions/workflows/*/runs": (
+        requests_cache.EXPIRE_IMMEDIATELY
+    ),
+    "api.github.com/repos/*/actions/artifacts": requests_cache.EXPIRE_IMMEDIATELY,
+}
+
+# Once fewer than this many requests remain in the rate limit budget, spread
+# the remainder evenly until the budget resets.
+RATE_LIMIT_LOW_WATER = 100
+# GitHub asks for at least a second between requests which create content.
+MUTATION_INTERVAL = 1.0
+MUTATING_METHODS = frozenset({"POST", "PATCH", "PUT", "DELETE"})
+# Default limit on the total size of archives being downloaded at once
+DEFAULT_DOWNLOAD_BUDGET = 2 * 1024**3
+# Besides the .wasm itself, the Godot engine loads these files from paths made by
+# appending a suffix to GODOT_CONFIG.executable, so they are shared along with
+# it. index.html also loads the .js file directly.
+ENGINE_COMPANIONS = (
+    ".js",
+    ".worker.js",
+    ".audio.worklet.js",
+    ".audio.position.worklet.js",
+    ".side.wasm",
+)
+
+# Directory of the site which files shared by several builds are moved into
+SHARED_DIR = "_shared"
+
+# How much of the end of a zip archive to fetch first when downloading it in
+# parts. This is enough for the end of central directory record with the
+# longest possible comment, and usually the whole central directory.
+ZIP_TAIL_SIZE = 64 * 1024
+
+# Retries for rate-limited requests and (for idempotent requests) server and
+# connection errors
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Rather than wait longer than this for the rate limit to reset, give up.
+MAX_RATE_LIMIT_WAIT = dt.timedelta(minutes=15)
+
+# "runs" scans the build workflow's run history, newest first; "branches" lists
+# live branches and looks up the newest run for each; "auto" picks whichever
+# looks cheaper.
+DISCOVERY_STRATEGIES = ("auto", "runs", "branches")
+# Whether to list forks' branches and pull requests with the REST API or in
+# bulk with the GraphQL API.
+DISCOVERY_BACKENDS = ("rest", "graphql")
+# Number of repositories whose branches, or of branch names whose closed pull
+# requests, are fetched per GraphQL query
+GRAPHQL_BATCH_SIZE = 50
+# Fields of each pull request fetched with the GraphQL API
+GRAPHQL_PULL_REQUEST_FIELDS = """
+    number title url state updatedAt headRefName headRefOid
+    headRepositoryOwner { login }
+    headRepository { nameWithOwner }
+"""
+
 
 class ConfigurationError(Exception):
     pass
 
 
+class GraphQLError(Exception):
+    pass
+
+
 @dataclasses.dataclass
 class StatusData:
     """Data to pass from the amalgamate stage (run before the GitHub Pages site
@@ -84,24 +189,1486 @@ class Release:
     asset: dict
 
 
+@dataclasses.dataclass
+class Download:
+    """An archive to download and extract into dest_dir."""
+
+    label: str
+    url: str
+    dest_dir: pathlib.Path
+    # Size of the archive itself, as reported by the API
+    size: int
+    # Sort key deciding which of several identical files is kept
+    rank: tuple
+    # Identifies the archive's contents; see BuildStore
+    key: str
+    headers: dict[str, str] | None = None
+    # Digest of the archive, if known, shared by identical archives
+    digest: str | None = None
+
+
+class ByteBudget:
+    """Limits the total size of downloads in flight at once. A download larger
+    than the whole budget may start when nothing else is in flight, rather than
+    never starting at all."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size: int) -> None:
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.in_flight == 0 or self.in_flight + size <= self.limit
+            )
+            self.in_flight += size
+
+    def release(self, size: int) -> None:
+        with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+
+@dataclasses.dataclass
+class Member:
+    """A file extracted from a build archive."""
+
+    size: int
+    crc32: int
+    # Hash of the file's contents, if it was needed for deduplication
+    sha256: str | None = None
+
+
+def zip_members(tail: bytes) -> dict[str, Member] | None:
+    """Returns the members of a zip archive, given the end of it, or None if
+    that does not hold the whole central directory."""
+    try:
+        # ZipFile allows for data before the central directory which is not
+        # there, as it would for a self-extracting archive.
+        with zipfile.ZipFile(io.BytesIO(tail)) as zip_file:
+            return {
+                member.filename: Member(member.file_size, member.CRC)
+                for member in zip_file.infolist()
+            }
+    except zipfile.BadZipFile:
+        return None
+
+
+def is_safe_member(member: zipfile.ZipInfo) -> bool:
+    """Returns whether the member can be extracted to its own name without
+    the sanitisation which ZipFile.extract() performs."""
+    path = pathlib.PurePosixPath(member.filename)
+    return (
+        not path.is_absolute()
+        and ".." not in path.parts
+        and "\\" not in member.filename
+    )
+
+
+def extract_hashing(
+    zip_file: zipfile.ZipFile, member: zipfile.ZipInfo, dest: pathlib.Path
+) -> tuple[pathlib.Path, str]:
+    """Extracts member to a temporary file alongside dest, hashing it as it is
+    written, and returns the temporary file and the hash. The caller must
+    move the file into place or remove it."""
+    digest = sha256()
+    tmp_path = dest.with_name(f".{dest.name}.part")
+    try:
+        with zip_file.open(member) as source, tmp_path.open("wb") as f:
+            while chunk := source.read(1024 * 1024):
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return tmp_path, digest.hexdigest()
+
+
+def hash_file(path: pathlib.Path) -> str:
+    # Hashing a memory map avoids copying the file into Python objects, and
+    # hashlib releases the GIL while hashing it, so threads can hash files in
+    # parallel.
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return sha256(m).hexdigest()
+
+
+class HashCache:
+    """Hashes of files, kept between runs. Entries are keyed by the path, size
+    and modification time of the file, so a file is not hashed again unless it
+    is replaced or changed. Unlike device and inode numbers, these survive the
+    cache being saved and restored, which preserves modification times."""
+
+    def __init__(self, path: pathlib.Path | None) -> None:
+        self.path = path
+        self.entries: dict[str, str] = {}
+        if path is not None:
+            try:
+                self.entries = json.loads(path.read_text())
+            except FileNotFoundError:
+                pass
+            except ValueError as error:
+                logging.warning("Ignoring unreadable %s: %s", path, error)
+        # Entries looked up or added by this run
+        self.used: dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def hash(self, path: pathlib.Path) -> str:
+        st = path.stat()
+        key = f"{path}:{st.st_size}:{st.st_mtime_ns}"
+        with self.lock:
+            sha256_hash = self.entries.get(key)
+        if sha256_hash is None:
+            sha256_hash = hash_file(path)
+        with self.lock:
+            self.entries[key] = self.used[key] = sha256_hash
+        return sha256_hash
+
+    def save(self) -> None:
+        """Saves the entries used by this run, forgetting the rest."""
+        if self.path is not None:
+            self.path.write_text(json.dumps(self.used))
+
+
+class BuildStore:
+    """Extracted builds kept between runs, so that a build which has not changed
+    since the previous run can be copied from here rather than downloaded
+    again.
+
+    Each build is stored under a key made from whatever identifies its archive
+    on GitHub: its digest, if known, so that identical archives share an entry;
+    or else the ID of an artifact (which never changes), or the ID and
+    modification time of a release asset."""
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Keys of builds stored or retrieved by this run
+        self.used: set[str] = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def artifact_key(artifact: dict) -> str:
+        if digest := artifact.get("digest"):
+            key = f"digest-{digest}"
+        else:
+            key = f"artifact-{artifact['id']}"
+        return re.sub(r"[^\w.-]", "-", key)
+
+    @staticmethod
+    def asset_key(asset: dict) -> str:
+        if digest := asset.get("digest"):
+            key = f"digest-{digest}"
+        else:
+            key = f"asset-{asset['id']}-{asset['updated_at']}"
+        return re.sub(r"[^\w.-]", "-", key)
+
+    def tree(self, key: str) -> pathlib.Path:
+        return self.path / key / "tree"
+
+    def members(self, key: str) -> dict[str, Member] | None:
+        """Returns the members of the stored build, if there is one, without
+        keeping it for the next run."""
+        try:
+            return {
+                name: Member(**member)
+                for name, member in json.loads(
+                    (self.path / key / "members.json").read_text()
+                ).items()
+            }
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError, AttributeError) as error:
+            # Truncated, or written by a version with a different schema
+            logging.warning("Discarding unreadable build %s: %s", key, error)
+            shutil.rmtree(self.path / key, ignore_errors=True)
+            return None
+
+    def get(self, key: str) -> dict[str, Member] | None:
+        """Returns the members of the stored build, if there is one."""
+        members = self.members(key)
+        if members is not None:
+            with self.lock:
+                self.used.add(key)
+        return members
+
+    def put(
+        self, key: str, extract: Callable[[pathlib.Path], dict[str, Member]]
+    ) -> dict[str, Member]:
+        """Stores the build which extract() extracts to the given directory,
+        and returns its members."""
+        incoming = pathlib.Path(tempfile.mkdtemp(prefix=".incoming-", dir=self.path))
+        try:
+            tree = incoming / "tree"
+            tree.mkdir()
+            members = extract(tree)
+            (incoming / "members.json").write_text(
+                json.dumps(
+                    {
+                        name: dataclasses.asdict(member)
+                        for name, member in members.items()
+                    }
+                )
+            )
+            # A build is only visible under its key once it is complete
+            incoming.rename(self.path / key)
+        except BaseException:
+            shutil.rmtree(incoming, ignore_errors=True)
+            raise
+
+        with self.lock:
+            self.used.add(key)
+        return members
+
+    def contents_key(self) -> str:
+        """Returns a key which identifies the builds used by this run, and so,
+        after prune(), the contents of the store."""
+        return sha256("\n".join(sorted(self.used)).encode()).hexdigest()
+
+    def prune(self) -> None:
+        """Deletes builds which were not used by this run, along with any left
+        incomplete by an earlier run."""
+        for entry in self.path.iterdir():
+            if entry.name not in self.used:
+                logging.debug("Removing %s from build store", entry.name)
+                shutil.rmtree(entry, ignore_errors=True)
+
+
+# Given the lines of a Godot web build's index.html, and the path (without the
+# .wasm suffix) of the engine it should load, a config rewriter updates the
+# lines in place and returns the path they previously loaded the engine from,
+# or returns None and leaves them alone if it does not recognise them.
+ConfigRewriter = Callable[[list[str], str], str | None]
+
+
+def rewrite_godot_config(lines: list[str], exe: str) -> str | None:
+    """Rewrites the GODOT_CONFIG object of Godot 4 and Godot 3.3 onwards."""
+    for i, line in enumerate(lines):
+        if match := re.match(r"^(\s*)const GODOT_CONFIG = (.*);$", line):
+            break
+    else:
+        return None
+
+    # Although not all JavaScript source is valid JSON, we happen to
+    # know that Godot fills this value in using its JSON serializer.
+    config = json.loads(match.group(2))
+
+    # If mainPack is not explicitly set, it defaults to a path
+    # derived from executable, which we are about to change.
+    config.setdefault("mainPack", config["executable"] + ".pck")
+
+    # Overwrite the executable path (which is given without the .wasm
+    # suffix for some reason) and update the file size table (which uses
+    # the suffix, and may also list the side module of builds with
+    # GDExtension support).
+    previous_exe = config["executable"]
+    config["executable"] = exe
+    file_sizes = config.get("fileSizes", {})
+    for suffix in (".wasm", ".side.wasm"):
+        if f"{previous_exe}{suffix}" in file_sizes:
+            file_sizes[f"{exe}{suffix}"] = file_sizes.pop(f"{previous_exe}{suffix}")
+
+    config_json = json.dumps(config, separators=(",", ":"))
+    lines[i] = f"{match.group(1)}const GODOT_CONFIG = {config_json};"
+    return previous_exe
+
+
+def rewrite_godot3_start_game(lines: list[str], exe: str) -> str | None:
+    """Rewrites the options object passed to engine.startGame() by custom
+    Godot 3 loaders which are not configured with GODOT_CONFIG. The object
+    may span several lines."""
+    text = "\n".join(lines)
+    for call in re.finditer(r"\bstartGame\(\s*\{", text):
+        # The options run up to the matching closing brace
+        depth = 0
+        for end in range(call.end() - 1, len(text)):
+            if text[end] == "{":
+                depth += 1
+            elif text[end] == "}":
+                depth -= 1
+                if depth == 0:
+                    break
+        else:
+            continue
+        options_text = text[call.end() : end]
+        if match := re.search(r"\bexecutable\s*:\s*(['\"])([^'\"]*)\1", options_text):
+            break
+    else:
+        return None
+
+    previous_exe = match.group(2)
+    options = f"executable: {json.dumps(exe)}"
+    # As with GODOT_CONFIG, mainPack defaults to a path derived from
+    # executable.
+    if not re.search(r"\bmainPack\s*:", options_text):
+        options += f", mainPack: {json.dumps(previous_exe + '.pck')}"
+    start, stop = call.end() + match.start(), call.end() + match.end()
+    lines[:] = (text[:start] + options + text[stop:]).split("\n")
+    return previous_exe
+
+
+def rewrite_godot3_executable_name(lines: list[str], exe: str) -> str | None:
+    """Rewrites the EXECUTABLE_NAME constant of Godot 3.2 and earlier, which
+    passes it to engine.startGame() along with an explicit MAIN_PACK."""
+    for i, line in enumerate(lines):
+        if match := re.match(r"^(\s*)const EXECUTABLE_NAME = (['\"])(.*)\2;$", line):
+            break
+    else:
+        return None
+
+    lines[i] = f"{match.group(1)}const EXECUTABLE_NAME = {json.dumps(exe)};"
+    return match.group(3)
+
+
+# Tried in order until one recognises the index.html being patched
+CONFIG_REWRITERS: list[ConfigRewriter] = [
+    rewrite_godot_config,
+    rewrite_godot3_start_game,
+    rewrite_godot3_executable_name,
+]
+
+
+@dataclasses.dataclass
+class DuplicateGroup:
+    """Identical files, of which one copy is kept."""
+
+    rank: tuple
+    path: pathlib.Path
+    # Only computed once another file with the same size and CRC-32 turns up
+    sha256: str | None
+    # Directories whose index.html loads the kept copy
+    dependents: list[pathlib.Path] = dataclasses.field(default_factory=list)
+
+
+class GodotDeduplicator:
+    """Assuming each build is a Godot web build named index.{html,pck,wasm},
+    deduplicates index.wasm, and the rest of the engine alongside it (see
+    ENGINE_COMPANIONS), where possible as each build is extracted. Of each
+    set of identical files, the copy with the lowest rank is kept, whatever
+    order the builds arrive in. Gnarly but functional.
+
+    Files are compared by the size and CRC-32 recorded in their archive, and
+    only hashed when those collide, so a file with no duplicates is never
+    hashed."""
+
+    def __init__(
+        self, dest_dir: pathlib.Path, hash_cache: HashCache | None = None
+    ) -> None:
+        self.dest_dir = dest_dir
+        self.hash_cache = hash_cache or HashCache(None)
+        self.lock = threading.Lock()
+        # (size, CRC-32) -> groups of files with that size and checksum
+        self.groups: dict[tuple[int, int], list[DuplicateGroup]] = (
+            collections.defaultdict(list)
+        )
+        # Size, CRC-32 and group of each file added
+        self.files: dict[pathlib.Path, tuple[int, int, DuplicateGroup]] = {}
+        # Files replaced by another copy in a previous run, to be dealt with
+        # by finish()
+        self.deferred: list[
+            tuple[
+                pathlib.Path,
+                tuple,
+                int,
+                int,
+                str,
+                pathlib.Path,
+                int,
+                Callable[[], None],
+            ]
+        ] = []
+        # Bytes saved by replacing each file with another copy
+        self.saved: dict[pathlib.Path, int] = {}
+
+    @property
+    def deduplicated_bytes(self) -> int:
+        return sum(self.saved.values())
+
+    @staticmethod
+    def wants(filename: str) -> bool:
+        return pathlib.PurePosixPath(filename).name == "index.wasm"
+
+    def may_have(self, size: int, crc32: int) -> bool:
+        """Returns whether a file with this size and CRC-32 might be a copy of
+        one already kept."""
+        with self.lock:
+            return (size, crc32) in self.groups
+
+    def find_group(
+        self, size: int, crc32: int, sha256_hash: str
+    ) -> DuplicateGroup | None:
+        """Finds the group holding a file with this size, CRC-32 and hash.
+        Must be called with the lock held."""
+        for group in self.groups.get((size, crc32), ()):
+            if group.sha256 is None:
+                group.sha256 = self.hash_cache.hash(group.path)
+            if group.sha256 == sha256_hash:
+                return group
+        return None
+
+    def hash_groups(self, buckets: collections.abc.Iterable[tuple[int, int]]) -> None:
+        """Hashes the kept copies in the given buckets which find_group() would
+        otherwise hash while holding the lock, using a thread pool."""
+        buckets = set(buckets)
+        with self.lock:
+            groups = [
+                (group, group.path)
+                for bucket in buckets
+                for group in self.groups.get(bucket, ())
+                if group.sha256 is None
+            ]
+        if not groups:
+            return
+
+        def hash_path(path: pathlib.Path) -> str | None:
+            try:
+                return self.hash_cache.hash(path)
+            except FileNotFoundError:
+                # The kept copy was swapped for another while being hashed;
+                # find_group() hashes the new one if it is needed.
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            hashes = list(executor.map(hash_path, (path for _, path in groups)))
+
+        with self.lock:
+            for (group, path), sha256_hash in zip(groups, hashes):
+                if sha256_hash is not None and group.path == path:
+                    group.sha256 = sha256_hash
+
+    def has_one(self, size: int, crc32: int) -> bool:
+        """Returns whether exactly one distinct file with this size and CRC-32
+        has been kept, so that another file with the same size and CRC-32 can
+        be assumed to be a copy of it without hashing them."""
+        with self.lock:
+            return len(self.groups.get((size, crc32), ())) == 1
+
+    def link(
+        self, size: int, crc32: int, sha256_hash: str | None, dest: pathlib.Path
+    ) -> str | None:
+        """Hard-links the kept copy of the file with this size, CRC-32 and hash
+        to dest, if there is one and a link is possible, and returns its hash.
+        If the hash is not given, the size and CRC-32 must match exactly one
+        kept file."""
+        self.hash_groups([(size, crc32)])
+        with self.lock:
+            if sha256_hash is not None:
+                group = self.find_group(size, crc32, sha256_hash)
+            elif len(groups := self.groups.get((size, crc32), [])) == 1:
+                group = groups[0]
+                if group.sha256 is None:
+                    group.sha256 = self.hash_cache.hash(group.path)
+            else:
+                group = None
+            if group is None:
+                return None
+
+            dest.unlink(missing_ok=True)
+            try:
+                os.link(group.path, dest)
+            except OSError:
+                return None
+            return group.sha256
+
+    def add(
+        self,
+        path: pathlib.Path,
+        rank: tuple,
+        size: int,
+        crc32: int,
+        sha256_hash: str | None = None,
+    ) -> None:
+        # Do any hashing before taking the lock, so that other threads can
+        # carry on meanwhile.
+        if self.may_have(size, crc32):
+            if sha256_hash is None:
+                sha256_hash = self.hash_cache.hash(path)
+            self.hash_groups([(size, crc32)])
+
+        with self.lock:
+            group = None
+            if (size, crc32) in self.groups:
+                if sha256_hash is None:
+                    sha256_hash = self.hash_cache.hash(path)
+                group = self.find_group(size, crc32, sha256_hash)
+
+            if group is None:
+                logging.debug("%s has no duplicates yet", path)
+                group = DuplicateGroup(rank, path, sha256_hash)
+                self.groups[(size, crc32)].append(group)
+                self.files[path] = (size, crc32, group)
+                return
+
+            self.files[path] = (size, crc32, group)
+            target = group.path
+            if rank < group.rank:
+                # A build that arrived earlier was holding this file in place
+                # of this one. Swap them, unless its engine cannot be loaded
+                # from here, in which case this one is not deduplicated.
+                if (unused := self.patch_config(target.parent, path)) is None:
+                    return
+                logging.debug(
+                    "%s now holds hash %s, not %s", path, group.sha256, target
+                )
+                group.rank, group.path = rank, path
+                # Its dependents load the rest of the engine from it, so they
+                # must be updated before it is removed.
+                for dirpath in group.dependents:
+                    self.patch_config(dirpath, path)
+                path, target = target, path
+            else:
+                logging.debug(
+                    "%s has duplicate hash %s, target is %s", path, group.sha256, target
+                )
+                unused = self.patch_config(path.parent, target)
+
+            if unused:
+                group.dependents.append(path.parent)
+                self.saved[path] = self.remove_unused(
+                    path.parent, target.parent, unused
+                )
+
+    def defer(
+        self,
+        path: pathlib.Path,
+        rank: tuple,
+        size: int,
+        crc32: int,
+        sha256_hash: str,
+        target: pathlib.Path,
+        saved: int,
+        restore: Callable[[], None],
+    ) -> None:
+        """Adds a file which a previous run already replaced with target,
+        saving the given number of bytes. If target turns out to be the copy
+        kept this time, nothing needs to be done; otherwise restore() puts the
+        file, its companions and its index.html back, and it is added as
+        usual."""
+        with self.lock:
+            self.deferred.append(
+                (path, rank, size, crc32, sha256_hash, target, saved, restore)
+            )
+
+    def finish(self) -> None:
+        """Deals with files passed to defer(), once every file has been added."""
+        self.hash_groups((size, crc32) for _, _, size, crc32, *_ in self.deferred)
+        for (
+            path,
+            rank,
+            size,
+            crc32,
+            sha256_hash,
+            target,
+            saved,
+            restore,
+        ) in self.deferred:
+            group = self.find_group(size, crc32, sha256_hash)
+            if group and group.path == target:
+                self.files[path] = (size, crc32, group)
+                group.dependents.append(path.parent)
+                self.saved[path] = saved
+            else:
+                logging.debug("%s no longer loads %s", path.parent, target)
+                restore()
+                self.add(path, rank, size, crc32, sha256_hash)
+        self.deferred.clear()
+
+    def discard(self, paths: collections.abc.Iterable[pathlib.Path]) -> None:
+        """Forgets files which have been removed along with the rest of their
+        build. None of them may be the kept copy of a file."""
+        for path in paths:
+            if (entry := self.files.pop(path, None)) is None:
+                continue
+            group = entry[2]
+            assert group.path != path, f"{path} is still needed"
+            if path.parent in group.dependents:
+                group.dependents.remove(path.parent)
+            self.saved.pop(path, None)
+
+    def state(self, root: pathlib.Path) -> dict[str, dict[str, Any]]:
+        """Describes each file added, with paths relative to root, for a
+        SiteManifest."""
+        state = {}
+        for path, (size, crc32, group) in self.files.items():
+            target = None
+            if path.parent in group.dependents:
+                target = str(group.path.relative_to(root))
+            state[str(path.relative_to(root))] = {
+                "size": size,
+                "crc32": crc32,
+                "sha256": group.sha256,
+                "target": target,
+            }
+        return state
+
+    def remove_unused(
+        self, dirpath: pathlib.Path, target_dir: pathlib.Path, names: list[str]
+    ) -> int:
+        """Removes the named files from dirpath, where target_dir has an
+        identical file of the same name to be loaded in their place, and
+        returns their total size."""
+        removed = 0
+        for name in names:
+            path = dirpath / name
+            if self.identical(path, target_dir / name):
+                removed += path.stat().st_size
+                path.unlink()
+        return removed
+
+    def identical(self, path: pathlib.Path, other: pathlib.Path) -> bool:
+        """Returns whether both files exist and have the same contents."""
+        try:
+            return path.samefile(other) or (
+                path.stat().st_size == other.stat().st_size
+                and self.hash_cache.hash(path) == self.hash_cache.hash(other)
+            )
+        except FileNotFoundError:
+            return False
+
+    def patch_config(
+        self, dirpath: pathlib.Path, target: pathlib.Path
+    ) -> list[str] | None:
+        """Patches dirpath/index.html to load target, and the engine files
+        alongside it, in place of whichever index.wasm it currently loads.
+        Returns the names of the files in dirpath which are no longer loaded,
+        or None if index.html could not be patched, or the engine files it
+        loads differ from those alongside target."""
+        # Typically the target will be at the root of the site, but it could
+        # be a sibling, e.g. latest release is Godot 4.6, but main and 1 or
+        # more branches are 4.7.
+        target_dir = target.parent.relative_to(dirpath, walk_up=True)
+        index_html = dirpath / "index.html"
+        lines = index_html.read_text().splitlines()
+
+        exe = f"{str(target_dir)}/index"
+        for rewriter in CONFIG_REWRITERS:
+            if (previous_exe := rewriter(lines, exe)) is not None:
+                break
+        else:
+            logging.warning(
+                "Could not find the Godot engine configuration in %s",
+                index_html.relative_to(self.dest_dir),
+            )
+            return None
+
+        # The rest of the engine is loaded from alongside the executable, so
+        # every file of it must match, not just index.wasm.
+        for suffix in ENGINE_COMPANIONS:
+            current = dirpath / f"{previous_exe}{suffix}"
+            wanted = target.parent / f"index{suffix}"
+            if (
+                suffix == ".js"
+                or not current.exists()
+                or self.identical(current, wanted)
+            ):
+                continue
+            logging.warning(
+                "Not deduplicating %s: %s differs from %s",
+                index_html.relative_to(self.dest_dir),
+                current.relative_to(self.dest_dir),
+                wanted.relative_to(self.dest_dir),
+            )
+            return None
+
+        unused = ["index.wasm"] + [
+            f"index{suffix}" for suffix in ENGINE_COMPANIONS if suffix != ".js"
+        ]
+
+        # The engine's JavaScript is loaded by a script tag, quoted one way or
+        # another depending on the Godot version. If it differs, the build's
+        # own copy is left in place and still loaded.
+        if self.identical(dirpath / f"{previous_exe}.js", target.parent / "index.js"):
+            script = re.compile(
+                r"(<script\b[^>]*\bsrc=)(['\"])"
+                + re.escape(f"{previous_exe}.js")
+                + r"\2"
+            )
+            for j, line in enumerate(lines):
+                line, n = script.subn(lambda m: f"{m[1]}{m[2]}{exe}.js{m[2]}", line)
+                if n:
+                    lines[j] = line
+                    unused.append("index.js")
+
+        logging.info(
+            "Updating %s: replacing index.wasm with %s",
+            index_html.relative_to(self.dest_dir),
+            target_dir / "index.wasm",
+        )
+        # Replace the file rather than writing to it, since it may be a hard
+        # link into the build store.
+        index_html.unlink()
+        index_html.write_text("\n".join(lines))
+        return unused
+
+
+@dataclasses.dataclass
+class SharingConfig:
+    """Settings for FileSharer."""
+
+    # Smaller files are left alone
+    min_size: int = 256 * 1024
+    # Glob patterns of the files in which references to shared files are
+    # rewritten
+    rewrite: list[str] = dataclasses.field(
+        default_factory=lambda: ["*.html", "*.js", "*.css", "*.json"]
+    )
+
+    @classmethod
+    def from_env(cls) -> Self:
+        config = cls()
+        if value := os.environ.get("SHARE_FILES_MIN_SIZE_KB"):
+            config.min_size = int(value) * 1024
+        if value := os.environ.get("SHARE_FILES_REWRITE"):
+            config.rewrite = value.split()
+        return config
+
+
+class FileSharer:
+    """Moves large files which are identical in several builds into
+    SHARED_DIR, named by their SHA-256, and rewrites references to them in
+    each build's text files.
+
+    Unlike GodotDeduplicator, this knows nothing about what the files are, so
+    it only finds references written out literally, quoted or in CSS url(),
+    relative to the HTML or CSS file they appear in, or to the root of the
+    build in other files, such as scripts, whose URLs are resolved against the
+    page; and a copy is left in place unless a reference to it was found.
+
+    Text files can be shared too, such as scripts vendored into each build,
+    but a file which references are rewritten in stays in place, since it no
+    longer matches the other copies; so does an HTML or CSS file which refers
+    to other files of its build, since those references are relative to it."""
+
+    # The entry point of each build, and files left to GodotDeduplicator
+    excluded = frozenset(
+        [
+            "index.html",
+            "index.wasm",
+            *(f"index{suffix}" for suffix in ENGINE_COMPANIONS),
+        ]
+    )
+
+    def __init__(
+        self, dest_dir: pathlib.Path, config: SharingConfig, hash_cache: HashCache
+    ) -> None:
+        self.dest_dir = dest_dir
+        self.config = config
+        self.hash_cache = hash_cache
+        self.shared_bytes = 0
+
+    # Files whose references are resolved relative to the file itself
+    file_relative = ("*.html", "*.htm", "*.css")
+
+    def rewritable(self, name: str) -> bool:
+        path = pathlib.PurePosixPath(name)
+        return any(path.match(pattern) for pattern in self.config.rewrite)
+
+    def shareable(self, name: str) -> bool:
+        return pathlib.PurePosixPath(name).name not in self.excluded
+
+    def is_file_relative(self, text_name: str) -> bool:
+        path = pathlib.PurePosixPath(text_name)
+        return any(path.match(pattern) for pattern in self.file_relative)
+
+    def base_dir(self, text_name: str) -> str:
+        """Returns the directory of the build which references in the named
+        file are relative to."""
+        if self.is_file_relative(text_name):
+            return posixpath.dirname(text_name)
+        return ""
+
+    @staticmethod
+    def reference(path: str) -> re.Pattern:
+        return re.compile(r"(?<=[\"'(])(?:\./)?" + re.escape(path) + r"(?=[\"')?#])")
+
+    def share(self, builds: dict[str, list[str]]) -> list[tuple[str, str]]:
+        """Shares files between builds, given as a map from each build's
+        directory to its files, relative to the site and that directory
+        respectively. Returns the (directory, file) pairs which were removed."""
+        by_size: dict[int, list[tuple[str, str]]] = collections.defaultdict(list)
+        for site_path, names in sorted(builds.items()):
+            for name in sorted(names):
+                if not self.shareable(name):
+                    continue
+                try:
+                    size = (self.dest_dir / site_path / name).stat().st_size
+                except FileNotFoundError:
+                    # Removed by GodotDeduplicator
+                    continue
+                if size >= self.config.min_size:
+                    by_size[size].append((site_path, name))
+
+        candidates = [
+            candidate
+            for copies in by_size.values()
+            if len(copies) > 1
+            for candidate in copies
+        ]
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            hashes = executor.map(
+                self.hash_cache.hash,
+                (self.dest_dir / site_path / name for site_path, name in candidates),
+            )
+            by_hash: dict[str, list[tuple[str, str]]] = collections.defaultdict(list)
+            for candidate, sha256_hash in zip(candidates, hashes):
+                by_hash[sha256_hash].append(candidate)
+
+        @functools.cache
+        def read(site_path: str, name: str) -> str | None:
+            try:
+                return (self.dest_dir / site_path / name).read_text()
+            except (FileNotFoundError, UnicodeDecodeError):
+                return None
+
+        def refers(site_path: str, text_name: str, name: str) -> re.Pattern | None:
+            """Returns the pattern matching references to name in text_name,
+            if there are any."""
+            text = read(site_path, text_name)
+            text_dir = self.base_dir(text_name)
+            reference = self.reference(posixpath.relpath(name, text_dir or "."))
+            if text is not None and reference.search(text):
+                return reference
+            return None
+
+        def pinned(site_path: str, name: str) -> bool:
+            """Returns whether the file cannot be moved, because references
+            are rewritten in it, or it is an HTML or CSS file which refers
+            to other files of its build."""
+            if (site_path, name) in rewrites:
+                return True
+            return self.is_file_relative(name) and any(
+                refers(site_path, name, other)
+                for other in builds[site_path]
+                if other != name
+            )
+
+        # (directory, text file) -> [(reference, replacement)]
+        rewrites: dict[tuple[str, str], list[tuple[re.Pattern, str]]] = (
+            collections.defaultdict(list)
+        )
+        # Files which have been moved into SHARED_DIR
+        moved: set[tuple[str, str]] = set()
+        removed = []
+        # Text files are shared last, once the references to other files
+        # which are rewritten in them are known.
+        for sha256_hash, copies in sorted(
+            by_hash.items(), key=lambda item: self.rewritable(item[1][0][1])
+        ):
+            if len(copies) < 2:
+                continue
+
+            # Find the references to each copy
+            found = []
+            for site_path, name in copies:
+                if self.rewritable(name) and pinned(site_path, name):
+                    continue
+                references = []
+                for text_name in builds[site_path]:
+                    if text_name == name or not self.rewritable(text_name):
+                        continue
+                    if reference := refers(site_path, text_name, name):
+                        references.append(
+                            (text_name, self.base_dir(text_name), reference)
+                        )
+                # A file which has already been moved cannot be rewritten,
+                # so anything it refers to must stay.
+                if references and not any(
+                    (site_path, text_name) in moved for text_name, *_ in references
+                ):
+                    found.append((site_path, name, references))
+            if len(found) < 2:
+                continue
+
+            shared = f"{SHARED_DIR}/{sha256_hash}/{posixpath.basename(found[0][1])}"
+            logging.info("Sharing %d copies of %s", len(found), shared)
+            (self.dest_dir / shared).parent.mkdir(parents=True, exist_ok=True)
+            os.replace(
+                self.dest_dir / found[0][0] / found[0][1], self.dest_dir / shared
+            )
+            for site_path, name, references in found:
+                (self.dest_dir / site_path / name).unlink(missing_ok=True)
+                removed.append((site_path, name))
+                moved.add((site_path, name))
+
+                for text_name, text_dir, reference in references:
+                    replacement = posixpath.relpath(
+                        shared, posixpath.join(site_path, text_dir)
+                    )
+                    rewrites[site_path, text_name].append((reference, replacement))
+            size = (self.dest_dir / shared).stat().st_size
+            self.shared_bytes += size * (len(found) - 1)
+
+        for (site_path, text_name), replacements in rewrites.items():
+            text = read(site_path, text_name)
+            assert text is not None
+            for reference, replacement in replacements:
+                text = reference.sub(lambda _: replacement, text)
+            # Replace the file rather than writing to it, since it may be a
+            # hard link into the build store.
+            path = self.dest_dir / site_path / text_name
+            path.unlink()
+            path.write_text(text)
+
+        return removed
+
+
+class SitePlanner:
+    """Decides which builds to publish within a size budget for the site,
+    before any of them is downloaded. Builds are offered in order of priority,
+    and each is published if it still fits.
+
+    A build takes up the total size of its files, less its engine if the same
+    engine has already been planned, since GodotDeduplicator will share it.
+    The files are those in the build store or, failing that, those listed in
+    the archive's central directory; if neither is known, the build is assumed
+    to take up the size of its archive. A build identical to one already
+    planned takes up no space, since it will be replaced by a redirect."""
+
+    def __init__(self, budget: int, build_store: BuildStore | None) -> None:
+        self.budget = budget
+        self.build_store = build_store
+        self.planned_bytes = 0
+        self.digests: set[str] = set()
+        # Size and CRC-32 of each index.wasm planned
+        self.engines: set[tuple[int, int]] = set()
+
+    def admit(
+        self,
+        size: int,
+        key: str,
+        digest: str | None,
+        force: bool = False,
+        listed: dict[str, Member] | None = None,
+    ) -> str | None:
+        """Plans a build with the given archive size, BuildStore key and
+        digest if it fits, or regardless if force is true. The members listed
+        in its archive are used if it is not in the build store. Returns the
+        reason it was not planned, or None if it was."""
+        if digest is not None and digest in self.digests:
+            return None
+
+        members = self.build_store.members(key) if self.build_store else None
+        if members is None:
+            members = listed
+        engines = set()
+        if members is not None:
+            size = sum(member.size for member in members.values())
+            for name, member in members.items():
+                if not GodotDeduplicator.wants(name):
+                    continue
+                engine = (member.size, member.crc32)
+                engines.add(engine)
+                if engine in self.engines:
+                    parent = pathlib.PurePosixPath(name).parent
+                    size -= member.size + sum(
+                        members[companion].size
+                        for suffix in ENGINE_COMPANIONS
+                        if (companion := str(parent / f"index{suffix}")) in members
+                    )
+
+        if not force and self.planned_bytes + size > self.budget:
+            return (
+                f"it would take the site over its size budget of "
+                f"{self.budget // 1024**2} MiB"
+            )
+
+        self.planned_bytes += size
+        self.engines |= engines
+        if digest is not None:
+            self.digests.add(digest)
+        return None
+
+
+@dataclasses.dataclass
+class SiteManifest:
+    """Records what a run put in the site directory, so that the next run can
+    update it in place. Paths are relative to the site directory."""
+
+    # Directory of each build -> its BuildStore key
+    builds: dict[str, str] = dataclasses.field(default_factory=dict)
+    # Directory of each build -> the files extracted from it, relative to that
+    # directory
+    files: dict[str, list[str]] = dataclasses.field(default_factory=dict)
+    # See GodotDeduplicator.state()
+    wasms: dict[str, dict[str, Any]] = dataclasses.field(default_factory=dict)
+    # Directories of builds which FileSharer removed files from
+    shared: list[str] = dataclasses.field(default_factory=list)
+    # Directory of each build replaced by a redirect -> the directory of the
+    # identical build it redirects to
+    aliases: dict[str, str] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> Self | None:
+        try:
+            with path.open() as fp:
+                return cls(**json.load(fp))
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError) as error:
+            logging.warning("Ignoring unreadable %s: %s", path, error)
+            return None
+
+    def dump(self, path: pathlib.Path) -> None:
+        with path.open("w") as fp:
+            json.dump(dataclasses.asdict(self), fp)
+
+
+@dataclasses.dataclass
+class Assembly:
+    """State shared by the threads assembling the site."""
+
+    dest_dir: pathlib.Path
+    budget: ByteBudget
+    deduplicator: GodotDeduplicator
+    # What a previous run left in dest_dir, if it is being updated in place
+    previous: SiteManifest | None
+    # Where builds are extracted before being linked into place
+    store: BuildStore
+    manifest: SiteManifest = dataclasses.field(default_factory=SiteManifest)
+    # Build directories whose previous contents have been removed
+    cleared: set[str] = dataclasses.field(default_factory=set)
+    # Directories which files have been removed from
+    emptied: set[pathlib.Path] = dataclasses.field(default_factory=set)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+    def record(self, site_path: str, key: str, members: dict[str, Member]) -> None:
+        with self.lock:
+            self.manifest.builds[site_path] = key
+            self.manifest.files[site_path] = [
+                name for name in members if not name.endswith("/")
+            ]
+
+    def clear(self, site_path: str) -> None:
+        """Removes the files of the build which a previous run put in
+        site_path, if any."""
+        with self.lock:
+            if (
+                self.previous is None
+                or site_path in self.cleared
+                or (
+                    site_path not in self.previous.builds
+                    and site_path not in self.previous.aliases
+                )
+            ):
+                return
+            self.cleared.add(site_path)
+
+        logging.debug("Removing previous build from %s", site_path)
+        # An alias is just a redirect
+        self.remove(site_path, self.previous.files.get(site_path, ["index.html"]))
+
+    def remove(self, site_path: str, names: list[str]) -> None:
+        for name in names:
+            path = self.dest_dir / site_path / name
+            path.unlink(missing_ok=True)
+            with self.lock:
+                self.emptied.add(path.parent)
+
+    def finish(self) -> None:
+        """Removes builds from a previous run which are no longer published,
+        and any directories left empty."""
+        if self.previous is not None:
+            for site_path in (
+                self.previous.builds.keys() | self.previous.aliases.keys()
+            ) - (self.manifest.builds.keys() | self.manifest.aliases.keys()):
+                logging.info("Removing departed build %s", site_path)
+                self.clear(site_path)
+
+        for directory in sorted(self.emptied, key=lambda d: len(d.parts), reverse=True):
+            while directory != self.dest_dir and directory.is_dir():
+                if any(directory.iterdir()):
+                    break
+                directory.rmdir()
+                directory = directory.parent
+
+
+def link_file(src: str | os.PathLike, dest: str | os.PathLike) -> None:
+    """Hard-links src to dest, replacing dest if it exists, or copies it if a
+    link is not possible (for instance, across filesystems)."""
+    pathlib.Path(dest).unlink(missing_ok=True)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+def link_tree(src: pathlib.Path, dest: pathlib.Path) -> None:
+    shutil.copytree(src, dest, copy_function=link_file, dirs_exist_ok=True)
+
+
+@dataclasses.dataclass
+class PageCount:
+    """Tracks how many pages GitHubApi.paginate() has fetched, and how many
+    items the listing holds in total if the API says so."""
+
+    fetched: int = 0
+    total_count: int | None = None
+    per_page: int = 100
+
+    @property
+    def remaining(self) -> int | None:
+        if self.total_count is None:
+            return None
+        return max(0, math.ceil(self.total_count / self.per_page) - self.fetched)
+
+
+class ArtifactIndex:
+    """Lazily-populated map from workflow run ID to the artifact it produced,
+    read from a single repository-wide listing of artifacts with a given name
+    rather than one listing per run.
+
+    The listing is newest first, and no artifact is older than the run that
+    produced it, so it is only read as far as the oldest run looked up so far.
+    A miss is only conclusive once the listing has been read past the run's
+    creation (see covers()); otherwise callers should fall back to listing the
+    run's own artifacts."""
+
+    def __init__(self, artifacts: Iterator[dict]):
+        self._artifacts = artifacts
+        self._by_run: dict[int, dict] = {}
+        self._oldest: dt.datetime | None = None
+        self._exhausted = False
+        # Whether reading the listing failed before its end
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def get(self, run: dict) -> dict | None:
+        with self._lock:
+            return self._get(run)
+
+    def _get(self, run: dict) -> dict | None:
+        run_created = dt.datetime.fromisoformat(run["created_at"])
+        while run["id"] not in self._by_run and not self._exhausted:
+            if self._oldest is not None and self._oldest < run_created:
+                break
+
+            try:
+                artifact = next(self._artifacts)
+            except StopIteration:
+                self._exhausted = True
+                break
+            except requests.HTTPError as error:
+                logging.warning(
+                    "Failed to list artifacts (%s); looking them up per run instead",
+                    error,
+                )
+                self._exhausted = self._failed = True
+                break
+
+            if workflow_run := artifact.get("workflow_run"):
+                # Keep the newest if a run produced several with the same name
+                self._by_run.setdefault(workflow_run["id"], artifact)
+            self._oldest = dt.datetime.fromisoformat(artifact["created_at"])
+
+        return self._by_run.get(run["id"])
+
+    def covers(self, run: dict) -> bool:
+        """Returns whether the listing has been read far enough that any
+        artifact produced by run would have been found by get()."""
+        run_created = dt.datetime.fromisoformat(run["created_at"])
+        with self._lock:
+            if self._failed:
+                return False
+            return self._exhausted or (
+                self._oldest is not None and self._oldest < run_created
+            )
+
+
+@dataclasses.dataclass
+class TransportConfig:
+    """Settings for GitHubApi's HTTP connections."""
+
+    # Maximum number of concurrent requests
+    concurrency: int = 4
+    # Seconds to wait for a connection, and between bytes of a response
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+    # If a download is slower than this many bytes per second after
+    # hedge_delay seconds, start a second attempt and keep whichever finishes
+    # first. 0 disables hedging.
+    hedge_throughput: int = 1_000_000
+    hedge_delay: float = 10.0
+
+    @classmethod
+    def from_env(cls) -> Self:
+        config = cls()
+        for field in dataclasses.fields(cls):
+            if value := os.environ.get(field.name.upper()):
+                setattr(config, field.name, type(getattr(config, field.name))(value))
+        return config
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class RangeNotSatisfied(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class DownloadAttempt:
+    file: IO[bytes]
+    started: float
+    received: int = 0
+    cancelled: threading.Event = dataclasses.field(default_factory=threading.Event)
+    future: concurrent.futures.Future | None = None
+
+    @property
+    def throughput(self) -> float:
+        return self.received / max(time.monotonic() - self.started, 1e-3)
+
+
 PagesConfig = dict[str, Any]
+# Called with the owner and branch when discovery finds a branch's build
+BuildCallback = Callable[[str, Branch], None]
 PullRequest = dict
 
 
+def is_json_response(response: requests.Response) -> bool:
+    return response.headers.get("Content-Type", "").startswith("application/json")
+
+
+def ignore_vary_authorization(response: requests.Response, *args, **kwargs) -> None:
+    """GitHub says its responses vary by Authorization, but the token changes on
+    every CI run, which would make every cached response a miss. Each cache
+    belongs to a single repository, so this is safe to ignore."""
+    if vary := response.headers.get("Vary"):
+        response.headers["Vary"] = ", ".join(
+            header
+            for header in map(str.strip, vary.split(","))
+            if header.lower() != "authorization"
+        )
+
+
+def refresh_expired(artifact: dict) -> dict:
+    """Sets artifact["expired"] if it has expired since it was cached."""
+    if not artifact["expired"] and artifact.get("expires_at"):
+        expires_at = dt.datetime.fromisoformat(artifact["expires_at"])
+        artifact["expired"] = expires_at <= dt.datetime.now(tz=dt.timezone.utc)
+    return artifact
+
+
+class RateLimiter:
+    """Paces requests according to GitHub's rate limit headers, and decides
+    whether and when to retry failed requests.
+
+    See https://docs.github.com/en/rest/using-the-rest-api/best-practices-for-using-the-rest-api
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # Keyed by X-RateLimit-Resource, e.g. "core" or "graphql"
+        self._remaining: dict[str, int] = {}
+        self._reset: dict[str, float] = {}
+        self._next_request: dict[str, float] = {}
+        self._next_mutation = 0.0
+        self.phase = "setup"
+        # Requests which counted against the rate limit, by phase
+        self.used: collections.Counter[str] = collections.Counter()
+
+    @staticmethod
+    def resource(request: requests.PreparedRequest) -> str | None:
+        if not request.url or not request.url.startswith(API):
+            return None
+        return "graphql" if request.url.startswith(GRAPHQL_API) else "core"
+
+    @classmethod
+    def is_mutation(cls, request: requests.PreparedRequest) -> bool:
+        """Returns whether the request may change something, and so must be
+        spaced out and not retried. GraphQL queries are sent with POST, but
+        only read."""
+        if request.method not in MUTATING_METHODS:
+            return False
+        if cls.resource(request) == "graphql" and request.body:
+            query = json.loads(request.body).get("query", "")
+            return query.lstrip().startswith("mutation")
+        return True
+
+    def wait(self, request: requests.PreparedRequest) -> None:
+        resource = self.resource(request)
+        if resource is None:
+            return
+
+        with self._lock:
+            now = time.time()
+            delay = 0.0
+            remaining = self._remaining.get(resource)
+            if remaining is not None and remaining < RATE_LIMIT_LOW_WATER:
+                interval = max(0.0, self._reset[resource] - now) / max(remaining, 1)
+                slot = max(now, self._next_request.get(resource, 0.0))
+                self._next_request[resource] = slot + interval
+                delay = slot - now
+
+            if self.is_mutation(request):
+                delay = max(delay, self._next_mutation - now)
+                self._next_mutation = now + delay + MUTATION_INTERVAL
+
+        if delay > 0:
+            logging.debug("Waiting %.1fs before requesting %s", delay, request.url)
+            time.sleep(delay)
+
+    def update(self, response: requests.Response) -> None:
+        headers = response.headers
+        if "X-RateLimit-Remaining" not in headers:
+            return
+
+        resource = headers.get("X-RateLimit-Resource", "core")
+        with self._lock:
+            self._remaining[resource] = int(headers["X-RateLimit-Remaining"])
+            self._reset[resource] = float(headers["X-RateLimit-Reset"])
+            # Conditional requests answered with 304 Not Modified are free.
+            if response.status_code != 304:
+                self.used[self.phase] += 1
+
+    def retry_delay(
+        self,
+        request: requests.PreparedRequest,
+        response: requests.Response,
+        attempt: int,
+    ) -> float | None:
+        """Returns how long to wait before retrying the request, or None if it
+        should not be retried."""
+        if attempt >= MAX_RETRIES:
+            return None
+
+        backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+        headers = response.headers
+        rate_limited = response.status_code == 429 or (
+            response.status_code == 403
+            and (
+                headers.get("X-RateLimit-Remaining") == "0"
+                or "rate limit" in response.text.lower()
+            )
+        )
+        if rate_limited:
+            # The request was rejected without being processed, so it is safe
+            # to retry even if it is not idempotent.
+            if "Retry-After" in headers:
+                delay = float(headers["Retry-After"])
+            elif headers.get("X-RateLimit-Remaining") == "0":
+                delay = float(headers["X-RateLimit-Reset"]) - time.time() + 1
+            else:
+                # Secondary rate limit without further guidance: wait at
+                # least a minute.
+                delay = 60 * 2**attempt
+
+            if delay > MAX_RATE_LIMIT_WAIT.total_seconds():
+                return None
+            return max(delay, 0) + backoff
+
+        if response.status_code >= 500 and not self.is_mutation(request):
+            return backoff
+
+        return None
+
+
+class RateLimitedAdapter(requests.adapters.HTTPAdapter):
+    def __init__(
+        self, limiter: RateLimiter, timeout: tuple[float, float], **kwargs
+    ) -> None:
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.timeout = timeout
+
+    def send(
+        self, request: requests.PreparedRequest, *args, **kwargs
+    ) -> requests.Response:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+
+        attempt = 0
+        while True:
+            self.limiter.wait(request)
+            try:
+                response = super().send(request, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt >= MAX_RETRIES or self.limiter.is_mutation(request):
+
+                    raise
+                backoff = random.uniform(
+                    0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt)
+                )
+                logging.warning(
+                    "%s %s failed (%s); retrying in %.1fs",
+                    request.method,
+                    request.url,
+                    error,
+                    backoff,
+                )
+                time.sleep(backoff)
+                attempt += 1
+                continue
+            self.limiter.update(response)
+
+            delay = self.limiter.retry_delay(request, response, attempt)
+            if delay is None:
+                return response
+
+            logging.warning(
+                "%s %s failed with status %d; retrying in %.1fs",
+                request.method,
+                request.url,
+                response.status_code,
+                delay,
+            )
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+
 class GitHubApi:
-    def __init__(self, api_token: str):
-        if os.environ.get("CI") == "true":
-            logging.info("Running in CI; not caching responses")
+    def __init__(
+        self,
+        api_token: str,
+        cache_dir: pathlib.Path | None,
+        transport: TransportConfig | None = None,
+    ):
+        self.cache_dir = cache_dir
+        self.transport = transport or TransportConfig()
+        self.concurrency = self.transport.concurrency
+        if cache_dir is None:
+            logging.info(
+                "Running in CI without a cache directory; not caching responses"
+            )
             self._cache_backend = None
             self.session = requests.Session()
         else:
+            cache_dir.mkdir(parents=True, exist_ok=True)
             self._cache_backend = requests_cache.SQLiteCache(
-                use_cache_dir=True, db_path="godoctopus-cache"
+                cache_dir / "http-cache.sqlite"
             )
             logging.info("Caching responses to %s", self._cache_backend.db_path)
+            # Once a response is stale, it is revalidated with If-None-Match
+            # or If-Modified-Since; a 304 response does not count against the
+            # rate limit. Only API responses are cached, not downloads.
+            # GitHub's Cache-Control headers are ignored in favour of
+            # CACHE_POLICY: they say max-age=60 even for immutable resources.
             self.session = requests_cache.CachedSession(
-                backend=self._cache_backend, cache_control=True, expire_after=60
+                backend=self._cache_backend,
+                cache_control=False,
+                expire_after=60,
+                urls_expire_after=CACHE_POLICY,
+                filter_fn=is_json_response,
             )
+            self.session.hooks["response"].append(ignore_vary_authorization)
+
+        self.rate_limiter = RateLimiter()
+        # Worker threads may themselves prefetch pages concurrently, so allow
+        # for more connections than workers.
+        self.session.mount(
+            "https://",
+            RateLimitedAdapter(
+                self.rate_limiter,
+                timeout=(self.transport.connect_timeout, self.transport.read_timeout),
+                pool_maxsize=max(
+                    requests.adapters.DEFAULT_POOLSIZE, 2 * self.concurrency
+                ),
+            ),
+        )
 
         self.session.headers.update(
             {
@@ -116,28 +1683,337 @@ class GitHubApi:
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.session.close()
+        for phase, used in self.rate_limiter.used.items():
+            logging.info("%s used %d request(s) of the API rate limit", phase, used)
         if self._cache_backend:
-            self._cache_backend.delete(older_than=dt.timedelta(days=7))
+            # Nothing cached before the oldest workflow run which could still
+            # have an unexpired artifact is useful any more.
+            self._cache_backend.delete(
+                older_than=DEFAULT_ARTIFACT_RETENTION + RERUN_WINDOW
+            )
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Attributes API rate limit usage to the named phase."""
+        previous = self.rate_limiter.phase
+        self.rate_limiter.phase = name
+        try:
+            yield
+        finally:
+            self.rate_limiter.phase = previous
+
+    def get_json(self, url: str, params: dict | None = None) -> Any:
+        response = self.session.get(url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def paginate(
+        self,
+        url,
+        params: dict | None = None,
+        item_key: str | None = None,
+        page_count: PageCount | None = None,
+        prefetch: bool = False,
+        expire_after: requests_cache.ExpirationTime | None = None,
+    ) -> Iterator[dict]:
+        """Yields each item from each page of a listing.
+
+        If prefetch is True and the first page links to the last one, the
+        remaining pages are fetched concurrently, up to `concurrency` pages
+        ahead of the caller. Otherwise each page is fetched only when the
+        caller reaches it, so callers that stop early should not prefetch.
+
+        expire_after overrides CACHE_POLICY, except for prefetched pages."""
+        if not params:
+            params = {}
+        params.setdefault("per_page", 100)
+        if page_count:
+            page_count.per_page = params["per_page"]
+        cache_args: dict[str, Any] = (
+            {"expire_after": expire_after}
+            if expire_after is not None
+            and isinstance(self.session, requests_cache.CachedSession)
+            else {}
+        )
+
+        def page_items(j: Any) -> Iterator[dict]:
+            if page_count:
+                page_count.fetched += 1
+                if item_key and "total_count" in j:
+                    page_count.total_count = j["total_count"]
+            return iter(j[item_key] if item_key else j)
+
+        while True:
+            response = self.session.get(url, params=params, **cache_args)
+            response.raise_for_status()
+            yield from page_items(response.json())
+
+            next_link = response.links.get("next")
+            if not next_link:
+                break
+
+            if prefetch and (last_link := response.links.get("last")):
+                for j in self._prefetch_pages(next_link["url"], last_link["url"]):
+                    yield from page_items(j)
+                break
+
+            url = next_link["url"]
+            params = None
+
+    def graphql(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+        """Runs a GraphQL query, returning its data. Repositories which do not
+        exist come back as None rather than raising an exception."""
+        response = self.session.post(
+            GRAPHQL_API, json={"query": query, "variables": variables}
+        )
+        response.raise_for_status()
+        j = response.json()
+        errors = [
+            error for error in j.get("errors", []) if error.get("type") != "NOT_FOUND"
+        ]
+        if errors:
+            raise GraphQLError(*(error["message"] for error in errors))
+        return j["data"]
+
+    def download(
+        self, url: str, headers: collections.abc.Mapping[str, str | None] | None = None
+    ) -> IO[bytes]:
+        """Downloads url to a temporary file, which the caller must close.
+
+        If the download is slower than the hedge_throughput setting after
+        hedge_delay seconds, a second attempt is started, and whichever
+        finishes first is kept."""
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        attempts: list[DownloadAttempt] = []
+        hedged = not self.transport.hedge_throughput
+
+        def start() -> None:
+            attempt = DownloadAttempt(tempfile.TemporaryFile(), time.monotonic())
+            attempt.future = executor.submit(self._download, url, headers, attempt)
+            attempts.append(attempt)
+
+        start()
+        try:
+            while True:
+                concurrent.futures.wait(
+                    [attempt.future for attempt in attempts if attempt.future],
+                    timeout=1.0,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for attempt in list(attempts):
+                    assert attempt.future is not None
+                    if not attempt.future.done():
+                        continue
+                    if error := attempt.future.exception():
+                        attempts.remove(attempt)
+                        attempt.file.close()
+                        if not attempts:
+                            raise error
+                        logging.warning("Download attempt failed: %s", error)
+                        continue
+
+                    attempts.remove(attempt)
+                    attempt.file.seek(0)
+                    return attempt.file
+
+                first = attempts[0]
+                if (
+                    not hedged
+                    and time.monotonic() - first.started > self.transport.hedge_delay
+                    and first.throughput < self.transport.hedge_throughput
+                ):
+                    logging.info(
+                        "Download of %s is slow (%d bytes/s); starting another",
+                        url,
+                        first.throughput,
+                    )
+                    hedged = True
+                    start()
+        finally:
+            for attempt in attempts:
+                attempt.cancelled.set()
+                attempt.file.close()
+            executor.shutdown(wait=False)
+
+    def _download(
+        self,
+        url: str,
+        headers: collections.abc.Mapping[str, str | None] | None,
+        attempt: DownloadAttempt,
+    ) -> None:
+        with self.session.get(url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                if attempt.cancelled.is_set():
+                    raise DownloadCancelled()
+                attempt.file.write(chunk)
+                attempt.received += len(chunk)
+
+    def download_zip(
+        self,
+        url: str,
+        headers: dict[str, str] | None,
+        skip: Callable[[zipfile.ZipInfo], bool],
+    ) -> tuple[IO[bytes], set[str]]:
+        """Downloads a zip archive to a temporary file, which the caller must
+        close, leaving out the members for which skip() returns true if the
+        server supports range requests. Returns the file, in which the space
+        for those members is left empty, and their names.
+
+        Otherwise, or if the archive uses ZIP64 extensions, or there is nothing
+        to skip, the whole archive is downloaded with download(), and nothing
+        is skipped."""
+        f = tempfile.TemporaryFile()
+        try:
+            with self.session.get(
+                url,
+                headers={**(headers or {}), "Range": f"bytes=-{ZIP_TAIL_SIZE}"},
+                stream=True,
+            ) as response:
+                if response.status_code == 416:
+                    raise RangeNotSatisfied("range not satisfiable")
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RangeNotSatisfied("range requests not supported")
+
+                tail = response.content
+                tail_start, total = self._content_range(response)
+                # The archive itself is served from elsewhere, by a redirect
+                # which is only valid for a while.
+                blob_url = response.url
+
+            f.truncate(total)
+            f.seek(tail_start)
+            f.write(tail)
+
+            eocd = tail.rfind(b"PK\x05\x06")
+            if eocd < 0 or len(tail) - eocd < 22:
+                raise RangeNotSatisfied("end of central directory not found")
+            cd_size, cd_offset = struct.unpack_from("<II", tail, eocd + 12)
+            if cd_offset == 0xFFFFFFFF or tail_start + eocd < cd_offset + cd_size:
+                raise RangeNotSatisfied("ZIP64 archive")
+            # Everything from here on has already been fetched
+            fetched_from = min(tail_start, cd_offset)
+            if cd_offset < tail_start:
+                self._fetch_range(blob_url, f, cd_offset, tail_start)
+
+            f.seek(0)
+            if fetched_from == 0:
+                logging.debug("Fetched all of %s with its central directory", url)
+                return f, set()
+
+            with zipfile.ZipFile(f) as zip_file:
+                infolist = sorted(zip_file.infolist(), key=lambda m: m.header_offset)
+
+            # Each member's local header and data run up to the next member's
+            # local header, or to the central directory.
+            skipped = set()
+            ranges: list[list[int]] = []
+            ends = [member.header_offset for member in infolist[1:]] + [cd_offset]
+            for member, end in zip(infolist, ends):
+                if skip(member):
+                    skipped.add(member.filename)
+                elif ranges and ranges[-1][1] == member.header_offset:
+                    ranges[-1][1] = end
+                else:
+                    ranges.append([member.header_offset, end])
+            if not skipped:
+                raise RangeNotSatisfied("nothing to skip")
+
+            fetched = total - fetched_from
+            for start, end in ranges:
+                end = min(end, fetched_from)
+                if start < end:
+                    self._fetch_range(blob_url, f, start, end)
+                    fetched += end - start
+
+            logging.debug("Fetched %d of %d bytes of %s", fetched, total, url)
+            f.seek(0)
+            return f, skipped
+        except RangeNotSatisfied as error:
+            logging.debug("Downloading all of %s: %s", url, error)
+            f.close()
+            return self.download(url, headers), set()
+        except BaseException:
+            f.close()
+            raise
 
-    def paginate(
-        self, url, params: dict | None = None, item_key: str | None = None
-    ) -> Iterator[dict]:
-        if not params:
-            params = {}
-        params.setdefault("per_page", 100)
+    def list_zip(
+        self, url: str, headers: dict[str, str] | None = None
+    ) -> dict[str, Member] | None:
+        """Returns the members of a zip archive, read from its central
+        directory without downloading the rest, or None if that is not
+        possible."""
+        try:
+            with self.session.get(
+                url,
+                headers={**(headers or {}), "Range": f"bytes=-{ZIP_TAIL_SIZE}"},
+                stream=True,
+            ) as response:
+                if response.status_code != 206:
+                    logging.debug("Cannot list %s: HTTP %d", url, response.status_code)
+                    return None
+                return zip_members(response.content)
+        except requests.RequestException as error:
+            logging.debug("Cannot list %s: %s", url, error)
+            return None
+
+    @staticmethod
+    def _content_range(response: requests.Response) -> tuple[int, int]:
+        """Returns the start of the range in a 206 response, and the total
+        size of the resource."""
+        match = re.fullmatch(
+            r"bytes (\d+)-\d+/(\d+)", response.headers.get("Content-Range", "")
+        )
+        if not match:
+            raise RangeNotSatisfied(
+                f"unexpected Content-Range {response.headers.get('Content-Range')}"
+            )
+        return int(match.group(1)), int(match.group(2))
+
+    def _fetch_range(self, url: str, f: IO[bytes], start: int, end: int) -> None:
+        """Writes bytes start to end (exclusive) of url to the same place in f,
+        hedging the request as download() does."""
+        # The URL is signed, and the API token must not be sent along with it.
+        with self.download(
+            url, headers={"Authorization": None, "Range": f"bytes={start}-{end - 1}"}
+        ) as part:
+            # A server which ignores the range sends the whole archive
+            if os.fstat(part.fileno()).st_size != end - start:
+                raise RangeNotSatisfied(f"bytes {start}-{end - 1} not returned")
+            f.seek(start)
+            shutil.copyfileobj(part, f)
+
+    def _prefetch_pages(self, next_url: str, last_url: str) -> Iterator[Any]:
+        """Fetches pages from next_url to last_url inclusive, a bounded number
+        at a time, yielding their contents in order."""
+        parts = urlsplit(next_url)
+        query = parse_qs(parts.query)
+        first_page = int(query["page"][0])
+        last_page = int(parse_qs(urlsplit(last_url).query)["page"][0])
+        urls = (
+            parts._replace(
+                query=urlencode({**query, "page": page}, doseq=True)
+            ).geturl()
+            for page in range(first_page, last_page + 1)
+        )
 
-        while True:
-            response = self.session.get(url, params=params)
-            response.raise_for_status()
-            j = response.json()
-            if item_key:
-                yield from j[item_key]
-            else:
-                yield from j
-            if not response.links.get("next"):
-                break
-            url = response.links["next"]["url"]
-            params = None
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency
+        ) as executor:
+            futures = collections.deque(
+                executor.submit(self.get_json, url)
+                for url in itertools.islice(urls, self.concurrency)
+            )
+            try:
+                while futures:
+                    j = futures.popleft().result()
+                    if (url := next(urls, None)) is not None:
+                        futures.append(executor.submit(self.get_json, url))
+                    yield j
+            finally:
+                for future in futures:
+                    future.cancel()
 
 
 def lead_sorted(seq: collections.abc.KeysView[str], first: str) -> list[str]:
@@ -175,12 +2051,42 @@ class AmalgamatePages:
         pages_config: PagesConfig,
         workflow_name: str,
         artifact_name: str,
+        early_termination: bool = False,
+        artifact_retention: dt.timedelta | None = None,
+        discovery_strategy: str = "auto",
+        discovery_backend: str = "rest",
+        download_budget: int = DEFAULT_DOWNLOAD_BUDGET,
+        build_store: BuildStore | None = None,
+        partial_downloads: bool = True,
+        share_files: SharingConfig | None = None,
+        site_budget: int | None = None,
+        site_dir: pathlib.Path = DEFAULT_SITE_DIR,
     ):
         self.api = api
         self.default_repo = default_repo
         self.pages_config = pages_config
         self.workflow_name = workflow_name
         self.artifact_name = artifact_name
+        self.early_termination = early_termination
+        self.artifact_retention = artifact_retention
+        if discovery_strategy not in DISCOVERY_STRATEGIES:
+            raise ConfigurationError(
+                f"Unknown discovery strategy '{discovery_strategy}'; "
+                f"expected one of {', '.join(DISCOVERY_STRATEGIES)}"
+            )
+        self.discovery_strategy = discovery_strategy
+        if discovery_backend not in DISCOVERY_BACKENDS:
+            raise ConfigurationError(
+                f"Unknown discovery backend '{discovery_backend}'; "
+                f"expected one of {', '.join(DISCOVERY_BACKENDS)}"
+            )
+        self.discovery_backend = discovery_backend
+        self.download_budget = download_budget
+        self.build_store = build_store
+        self.partial_downloads = partial_downloads
+        self.share_files = share_files
+        self.site_budget = site_budget
+        self.site_dir = site_dir
 
         self.jinja_env = make_jinja2_env()
 
@@ -189,6 +2095,27 @@ class AmalgamatePages:
         response.raise_for_status()
         self.repo_details = response.json()
 
+    def get_artifact_retention(self) -> dt.timedelta:
+        """Returns the repository's artifact retention period, or the default
+        period if the token is not allowed to read it."""
+        response = self.api.session.get(
+            f"{API}/repos/{self.default_repo}/actions/permissions/artifact-and-log-retention"
+        )
+        if response.status_code in (403, 404):
+            logging.debug(
+                "Cannot read artifact retention period; assuming %d days",
+                DEFAULT_ARTIFACT_RETENTION.days,
+            )
+            return DEFAULT_ARTIFACT_RETENTION
+        response.raise_for_status()
+        return dt.timedelta(days=response.json()["days"])
+
+    @property
+    def artifact_cutoff(self) -> dt.datetime:
+        """Artifacts created before this time must have expired."""
+        assert self.artifact_retention is not None
+        return dt.datetime.now(tz=dt.timezone.utc) - self.artifact_retention
+
     @property
     def default_org(self) -> str:
         return self.repo_details["owner"]["login"]
@@ -216,7 +2143,9 @@ class AmalgamatePages:
 
     def list_branches(self, repo: str) -> list[dict]:
         try:
-            return list(self.api.paginate(f"{API}/repos/{repo}/branches"))
+            return list(
+                self.api.paginate(f"{API}/repos/{repo}/branches", prefetch=True)
+            )
         except requests.HTTPError as error:
             if error.response.status_code != 404:
                 raise
@@ -226,19 +2155,279 @@ class AmalgamatePages:
             )
             return []
 
+    def list_branches_graphql(self, repos: list[str]) -> dict[str, list[dict]]:
+        """Lists the branches of many repositories in one query, in the same
+        form as list_branches()."""
+        variables: dict[str, str] = {}
+        fields = []
+        for i, repo in enumerate(repos):
+            variables[f"owner{i}"], variables[f"name{i}"] = repo.split("/", 1)
+            fields.append(
+                f"r{i}: repository(owner: $owner{i}, name: $name{i}) {{"
+                ' refs(refPrefix: "refs/heads/", first: 100) {'
+                " pageInfo { hasNextPage } nodes { name target { oid } } } }"
+            )
+        query = "query({}) {{ {} }}".format(
+            ", ".join(f"${name}: String!" for name in variables),
+            " ".join(fields),
+        )
+        data = self.api.graphql(query, variables)
+
+        branches: dict[str, list[dict]] = {}
+        for i, repo in enumerate(repos):
+            repository = data[f"r{i}"]
+            if repository is None:
+                logging.debug(
+                    "%s not found; assuming this fork was deleted",
+                    repo,
+                )
+                branches[repo] = []
+            elif repository["refs"]["pageInfo"]["hasNextPage"]:
+                branches[repo] = self.list_branches(repo)
+            else:
+                branches[repo] = [
+                    {"name": ref["name"], "commit": {"sha": ref["target"]["oid"]}}
+                    for ref in repository["refs"]["nodes"]
+                ]
+        return branches
+
+    def submit_branch_listings(
+        self, executor: concurrent.futures.Executor, repos: dict[str, str]
+    ) -> dict[str, Callable[[], list[dict]]]:
+        """Starts listing the branches of each fork in repos, a map from owner
+        to repository name, returning a map from owner to a function that
+        waits for that fork's branches."""
+        if self.discovery_backend == "rest":
+            return {
+                owner_label: executor.submit(self.list_branches, full_name).result
+                for owner_label, full_name in repos.items()
+            }
+
+        def getter(
+            future: concurrent.futures.Future[dict[str, list[dict]]], full_name: str
+        ) -> Callable[[], list[dict]]:
+            return lambda: future.result()[full_name]
+
+        getters = {}
+        for batch in itertools.batched(repos.items(), GRAPHQL_BATCH_SIZE):
+            future = executor.submit(
+                self.list_branches_graphql, [full_name for _, full_name in batch]
+            )
+            for owner_label, full_name in batch:
+                getters[owner_label] = getter(future, full_name)
+        return getters
+
+    def pull_request_from_graphql(self, node: dict[str, Any]) -> PullRequest | None:
+        """Converts a pull request fetched with the GraphQL API to the same
+        form as the REST API, or returns None if its fork has been deleted."""
+        if node["headRepositoryOwner"] is None:
+            return None
+
+        label = "{}:{}".format(
+            node["headRepositoryOwner"]["login"], node["headRefName"]
+        )
+        pulls_url = f"{API}/repos/{self.default_repo}/pulls"
+        issues_url = f"{API}/repos/{self.default_repo}/issues"
+        return {
+            "number": node["number"],
+            "title": node["title"],
+            "html_url": node["url"],
+            "url": f"{pulls_url}/{node['number']}",
+            "comments_url": f"{issues_url}/{node['number']}/comments",
+            "state": "open" if node["state"] == "OPEN" else "closed",
+            "updated_at": node["updatedAt"],
+            "head": {
+                "label": label,
+                "ref": node["headRefName"],
+                "sha": node["headRefOid"],
+                "repo": (
+                    {"full_name": node["headRepository"]["nameWithOwner"]}
+                    if node["headRepository"]
+                    else None
+                ),
+            },
+        }
+
+    def iter_pull_requests_graphql(self) -> Iterator[PullRequest]:
+        """Yields all open pull requests, in the same form as the REST API.
+        Closed ones are looked up by find_closed_pull_requests_graphql() for
+        the branches which turn out to have a build."""
+        owner, name = self.default_repo.split("/", 1)
+        query = f"""
+            query($owner: String!, $name: String!, $cursor: String) {{
+              repository(owner: $owner, name: $name) {{
+                pullRequests(states: [OPEN], first: 100, after: $cursor,
+                             orderBy: {{field: UPDATED_AT, direction: DESC}}) {{
+                  pageInfo {{ hasNextPage endCursor }}
+                  nodes {{ {GRAPHQL_PULL_REQUEST_FIELDS} }}
+                }}
+              }}
+            }}
+        """
+
+        cursor = None
+        while True:
+            data = self.api.graphql(
+                query, {"owner": owner, "name": name, "cursor": cursor}
+            )
+            pull_requests = data["repository"]["pullRequests"]
+            for node in pull_requests["nodes"]:
+                if pr := self.pull_request_from_graphql(node):
+                    yield pr
+            if not pull_requests["pageInfo"]["hasNextPage"]:
+                break
+            cursor = pull_requests["pageInfo"]["endCursor"]
+
+    def find_closed_pull_requests_graphql(
+        self, labels: collections.abc.Iterable[str]
+    ) -> dict[str, PullRequest]:
+        """Returns a map from branch label to the most recently updated closed
+        pull request for that branch, for each of labels which has one. The
+        pull requests for up to 50 branch names are fetched per query. If a
+        branch name has more than 100 closed pull requests, its labels are
+        looked up with the REST API instead."""
+        owner, name = self.default_repo.split("/", 1)
+        by_ref: dict[str, set[str]] = collections.defaultdict(set)
+        for label in labels:
+            by_ref[label.split(":", 1)[1]].add(label)
+
+        closed: dict[str, PullRequest] = {}
+        for batch in itertools.batched(by_ref.items(), GRAPHQL_BATCH_SIZE):
+            variables = {"owner": owner, "name": name}
+            fields = []
+            for i, (ref, _) in enumerate(batch):
+                variables[f"ref{i}"] = ref
+                fields.append(
+                    f"p{i}: pullRequests(headRefName: $ref{i},"
+                    " states: [CLOSED, MERGED], first: 100,"
+                    " orderBy: {field: UPDATED_AT, direction: DESC}) {"
+                    " pageInfo { hasNextPage }"
+                    f" nodes {{ {GRAPHQL_PULL_REQUEST_FIELDS} }} }}"
+                )
+            query = (
+                "query($owner: String!, $name: String!, {}) {{"
+                " repository(owner: $owner, name: $name) {{ {} }} }}"
+            ).format(
+                ", ".join(f"$ref{i}: String!" for i in range(len(batch))),
+                " ".join(fields),
+            )
+            repository = self.api.graphql(query, variables)["repository"]
+
+            for i, (ref, wanted) in enumerate(batch):
+                pull_requests = repository[f"p{i}"]
+                for node in pull_requests["nodes"]:
+                    pr = self.pull_request_from_graphql(node)
+                    if pr and pr["head"]["label"] in wanted:
+                        closed.setdefault(pr["head"]["label"], pr)
+                if pull_requests["pageInfo"]["hasNextPage"]:
+                    for label in wanted - closed.keys():
+                        params = {
+                            "state": "closed",
+                            "head": label,
+                            "sort": "updated",
+                            "direction": "desc",
+                            "per_page": 1,
+                        }
+                        if pr := next(
+                            self.api.paginate(
+                                f"{API}/repos/{self.default_repo}/pulls", params=params
+                            ),
+                            None,
+                        ):
+                            closed[label] = pr
+
+        return closed
+
+    def update_pull_request_index(self, path: pathlib.Path) -> list[PullRequest]:
+        """Returns every pull request the repository has ever had, from an index
+        stored at path. The index is brought up to date by listing pull
+        requests most recently updated first, stopping at the first one which
+        has not been updated since the index was last saved."""
+        pull_requests: dict[str, PullRequest] = {}
+        last_updated_at = None
+        try:
+            with path.open() as f:
+                index = json.load(f)
+            pull_requests = index["pull_requests"]
+            last_updated_at = index["updated_at"]
+        except FileNotFoundError:
+            logging.info("No pull request index found at %s; creating it", path)
+        except (json.JSONDecodeError, KeyError) as error:
+            logging.warning("Ignoring invalid pull request index %s: %s", path, error)
+
+        updated = 0
+        for pr in self.api.paginate(
+            f"{API}/repos/{self.default_repo}/pulls",
+            params={"state": "all", "sort": "updated", "direction": "desc"},
+            prefetch=last_updated_at is None,
+        ):
+            if last_updated_at is not None and pr["updated_at"] < last_updated_at:
+                break
+
+            # Only keep the fields which are used later, to keep the index small
+            pull_requests[str(pr["number"])] = {
+                "number": pr["number"],
+                "title": pr["title"],
+                "html_url": pr["html_url"],
+                "url": pr["url"],
+                "comments_url": pr["comments_url"],
+                "state": pr["state"],
+                "updated_at": pr["updated_at"],
+                "head": {
+                    "label": pr["head"]["label"],
+                    "ref": pr["head"]["ref"],
+                    "sha": pr["head"]["sha"],
+                    "repo": pr["head"]["repo"]
+                    and {"full_name": pr["head"]["repo"]["full_name"]},
+                },
+            }
+            updated += 1
+        logging.info("Updated %d pull request(s) in index", updated)
+
+        if pull_requests:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            with tmp_path.open("w") as f:
+                json.dump(
+                    {
+                        "updated_at": max(
+                            pr["updated_at"] for pr in pull_requests.values()
+                        ),
+                        "pull_requests": pull_requests,
+                    },
+                    f,
+                )
+            tmp_path.replace(path)
+
+        return list(pull_requests.values())
+
     def list_pull_requests(self) -> dict[str, PullRequest]:
         """
         Returns a map from branch label to the best pull request for that branch,
         preferring open PRs to closed ones and more recently-updated ones to older
         ones. "Branch label" here means "user:branch". This is unambiguous because
         any given user/org can have at most one fork of a repo.
+
+        With the GraphQL backend, only open pull requests are listed; closed
+        ones are looked up after discovery, for branches which have a build.
         """
         branch_prs: dict[str, list[PullRequest]] = {}
 
-        for pr in self.api.paginate(
-            f"{API}/repos/{self.default_repo}/pulls",
-            params={"state": "all"},
-        ):
+        pull_requests: collections.abc.Iterable[PullRequest]
+        if self.discovery_backend == "graphql":
+            pull_requests = self.iter_pull_requests_graphql()
+        elif self.api.cache_dir is not None:
+            pull_requests = self.update_pull_request_index(
+                self.api.cache_dir / "pull-requests" / f"{self.default_repo}.json"
+            )
+        else:
+            pull_requests = self.api.paginate(
+                f"{API}/repos/{self.default_repo}/pulls",
+                params={"state": "all"},
+                prefetch=True,
+            )
+
+        for pr in pull_requests:
             branch_prs.setdefault(pr["head"]["label"], []).append(pr)
 
         return {
@@ -246,66 +2435,431 @@ class AmalgamatePages:
             for label, prs in branch_prs.items()
         }
 
-    def find_artifact(self, artifacts_url: str) -> dict[str, Any] | None:
-        for artifact in self.api.paginate(artifacts_url, item_key="artifacts"):
+    def find_artifact(
+        self,
+        artifacts_url: str,
+        expire_after: requests_cache.ExpirationTime | None = None,
+    ) -> dict[str, Any] | None:
+        for artifact in self.api.paginate(
+            artifacts_url, item_key="artifacts", expire_after=expire_after
+        ):
             if artifact["name"] == self.artifact_name:
-                return artifact
+                return refresh_expired(artifact)
         return None
 
-    def find_latest_artifacts(self, workflow_id: int) -> dict[str, Fork]:
-        artifacts: dict[str, Fork] = {}
-        for run in self.api.paginate(
-            f"{API}/repos/{self.default_repo}/actions/workflows/{workflow_id}/runs",
-            params={"status": "success"},
-            item_key="workflow_runs",
+    def list_artifacts(self) -> ArtifactIndex:
+        return ArtifactIndex(
+            self.api.paginate(
+                f"{API}/repos/{self.default_repo}/actions/artifacts",
+                params={"name": self.artifact_name},
+                item_key="artifacts",
+            )
+        )
+
+    def find_run_artifact(
+        self, run: dict, index: ArtifactIndex | None
+    ) -> dict[str, Any] | None:
+        if index:
+            if artifact := index.get(run):
+                return artifact
+            if index.covers(run):
+                # The run produced no artifact with this name, e.g. because
+                # the build failed or was cancelled.
+                return None
+            logging.debug(
+                "No artifact indexed for %s; listing its artifacts", run["url"]
+            )
+        # Until the run can no longer be re-run, its artifacts may be replaced
+        created = dt.datetime.fromisoformat(run["created_at"])
+        settled = dt.datetime.now(tz=dt.timezone.utc) - created > RERUN_WINDOW
+        return self.find_artifact(
+            run["artifacts_url"],
+            expire_after=requests_cache.NEVER_EXPIRE if settled else None,
+        )
+
+    def is_run_too_old(self, run: dict) -> bool:
+        # If the run finished before the retention window, any artifact it
+        # produced has expired.
+        return dt.datetime.fromisoformat(run["updated_at"]) < self.artifact_cutoff
+
+    def wants_artifact(self, branch: Branch | None, run: dict) -> bool:
+        """Returns whether the artifact of run, which is older than any run
+        already considered for branch, could improve on branch.build."""
+        if self.is_run_too_old(run):
+            return False
+        return not branch or not branch.build or branch.build.artifact["expired"]
+
+    @staticmethod
+    def merge_artifact(branch: Branch, run: dict, artifact: dict | None) -> None:
+        if artifact and (
+            not branch.build
+            or (branch.build.artifact["expired"] and not artifact["expired"])
         ):
-            head_repository = run["head_repository"]
-            if head_repository is None:
-                logging.debug(
-                    "Ignoring workflow run %s from deleted fork",
-                    run["html_url"],
-                )
+            branch.build = Build(workflow_run=run, artifact=artifact)
+        # TODO: You might hope that you could fetch
+        # https://api.github.com/repos/{repo}/actions/runs/{artifact['workflow_run']['id']}
+        # and inspect the pull_requests property to find the corresponding PR for each branch.
+        # But as discussed at https://github.com/orgs/community/discussions/25220 that
+        # property is always empty for builds from forks.
+
+    def consider_run(
+        self, branch: Branch, run: dict, index: ArtifactIndex | None
+    ) -> None:
+        """Updates branch.build from run, which is older than any run already
+        considered for the branch, if it has a better artifact."""
+        if self.wants_artifact(branch, run):
+            self.merge_artifact(branch, run, self.find_run_artifact(run, index))
+        elif self.is_run_too_old(run):
+            logging.debug(
+                "Not looking for artifacts of %s, which is too old", run["html_url"]
+            )
+
+    def workflow_runs_query(self, workflow_id: int, **params) -> tuple[str, dict]:
+        """Returns the URL and parameters to list successful runs of the
+        workflow which could still have unexpired artifacts."""
+        run_cutoff = self.artifact_cutoff - RERUN_WINDOW
+        return (
+            f"{API}/repos/{self.default_repo}/actions/workflows/{workflow_id}/runs",
+            {
+                "status": "success",
+                "created": f">={run_cutoff.date().isoformat()}",
+                "exclude_pull_requests": "true",
+                **params,
+            },
+        )
+
+    def count_runs(self, workflow_id: int) -> int:
+        url, params = self.workflow_runs_query(workflow_id, per_page=1)
+        response = self.api.session.get(url, params=params)
+        response.raise_for_status()
+        return response.json()["total_count"]
+
+    def discover_artifacts(
+        self,
+        workflow_id: int,
+        pull_requests: dict[str, PullRequest],
+        on_build: BuildCallback | None = None,
+    ) -> dict[str, Fork]:
+        """Finds the latest build of each live branch using the configured
+        strategy. If on_build is given, it is called (possibly from another
+        thread) with each branch as soon as its build is known to be final,
+        that is, as soon as it has an unexpired build."""
+        strategy = self.discovery_strategy
+        default_branches = None
+        if strategy == "auto":
+            # Scanning runs costs roughly a page of runs plus a page of
+            # artifacts per 100 runs, plus a listing of branches for every
+            # fork. Looking up branches costs about one request per branch
+            # name, since branches with the same name in different forks are
+            # looked up together.
+            run_pages = math.ceil(self.count_runs(workflow_id) / 100)
+            fork_prs = [
+                label
+                for label, pr in pull_requests.items()
+                if pr["state"] == "open"
+                and not label.startswith(f"{self.default_org}:")
+            ]
+            forks = {label.split(":", 1)[0] for label in fork_prs}
+            default_branches = self.list_branches(self.default_repo)
+            runs_cost = 2 * run_pages + len(forks) + 1
+            branches_cost = len(
+                {branch["name"] for branch in default_branches}
+                | {label.split(":", 1)[1] for label in fork_prs}
+            )
+            strategy = "branches" if branches_cost < runs_cost else "runs"
+            logging.info(
+                "Estimated cost of scanning runs: %d requests; "
+                "of looking up branches: %d requests; choosing %s",
+                runs_cost,
+                branches_cost,
+                strategy,
+            )
+
+        if strategy == "branches":
+            return self.find_branch_artifacts(
+                workflow_id, pull_requests, default_branches, on_build
+            )
+        return self.find_latest_artifacts(workflow_id, on_build)
+
+    def iter_branch_runs(
+        self, workflow_id: int, branch_name: str, wanted: int = 1
+    ) -> Iterator[dict]:
+        """Yields successful runs of the workflow on branches called
+        branch_name in any fork, newest first, for the given number of forks'
+        branches. If only one is wanted, the newest run is fetched on its own
+        since it is usually the only one needed."""
+        url, params = self.workflow_runs_query(workflow_id, branch=branch_name)
+        if wanted > 1:
+            yield from self.api.paginate(url, params=params, item_key="workflow_runs")
+            return
+
+        response = self.api.session.get(url, params={**params, "per_page": 1})
+        response.raise_for_status()
+        j = response.json()
+        yield from j["workflow_runs"]
+
+        if j["total_count"] > len(j["workflow_runs"]):
+            yield from itertools.islice(
+                self.api.paginate(url, params=params, item_key="workflow_runs"),
+                len(j["workflow_runs"]),
+                None,
+            )
+
+    def find_branch_artifacts(
+        self,
+        workflow_id: int,
+        pull_requests: dict[str, PullRequest],
+        default_branches: list[dict] | None = None,
+        on_build: BuildCallback | None = None,
+    ) -> dict[str, Fork]:
+        """Finds the latest build of each live branch of the default
+        repository, and of each branch with an open pull request from another
+        fork, by looking up runs for each branch name in turn. Branches with
+        the same name in different forks share one listing of runs, so this
+        costs a request or two per branch name, plus a request per 100 runs on
+        branches whose name is shared, regardless of the length of the rest of
+        the run history.
+
+        Branches in other forks without an open pull request are not found,
+        but would not be published anyway."""
+        if default_branches is None:
+            default_branches = self.list_branches(self.default_repo)
+        artifacts: dict[str, Fork] = {
+            self.default_org: Fork(
+                live_branches={
+                    branch["name"]: Branch(info=branch, build=None)
+                    for branch in default_branches
+                }
+            )
+        }
+        repos = {self.default_org: self.default_repo}
+
+        for label, pr in pull_requests.items():
+            owner_label, branch_name = label.split(":", 1)
+            if owner_label == self.default_org or pr["state"] != "open":
+                continue
+            if pr["head"]["repo"] is None:
+                logging.debug("Ignoring pull request %s from deleted fork", pr["url"])
                 continue
 
-            owner_label = head_repository["owner"]["login"]
-            try:
-                fork = artifacts[owner_label]
-            except KeyError:
-                fork = Fork(
-                    live_branches={
-                        branch["name"]: Branch(info=branch, build=None)
-                        for branch in self.list_branches(head_repository["full_name"])
-                    }
+            # An open pull request's head branch must exist, so there is no
+            # need to list the fork's branches.
+            fork = artifacts.setdefault(owner_label, Fork(live_branches={}))
+            fork.live_branches[branch_name] = Branch(
+                info={"name": branch_name, "commit": {"sha": pr["head"]["sha"]}},
+                build=None,
+            )
+            repos[owner_label] = pr["head"]["repo"]["full_name"]
+
+        # Branches waiting for a build, by name and then by repository
+        by_name: dict[str, dict[str, tuple[str, Branch]]] = collections.defaultdict(
+            dict
+        )
+        for owner_label, fork in artifacts.items():
+            for branch in fork.live_branches.values():
+                by_name[branch.name][repos[owner_label]] = owner_label, branch
+
+        def find_builds(
+            branch_name: str, waiting: dict[str, tuple[str, Branch]]
+        ) -> None:
+            """Pages through the runs on branches called branch_name once,
+            until every waiting branch has an unexpired build."""
+            for run in self.iter_branch_runs(workflow_id, branch_name, len(waiting)):
+                head_repository = run["head_repository"]
+                if head_repository is None or (
+                    head_repository["full_name"] not in waiting
+                ):
+                    continue
+
+                owner_label, branch = waiting[head_repository["full_name"]]
+                self.consider_run(branch, run, None)
+                if branch.build and not branch.build.artifact["expired"]:
+                    if on_build:
+                        on_build(owner_label, branch)
+                    del waiting[head_repository["full_name"]]
+                    if not waiting:
+                        break
+
+        # Each lookup only touches its own branches, so the result does not
+        # depend on the order in which they finish.
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.api.concurrency
+        ) as executor:
+            for future in [
+                executor.submit(find_builds, branch_name, waiting)
+                for branch_name, waiting in by_name.items()
+            ]:
+                future.result()
+
+        return artifacts
+
+    def find_latest_artifacts(
+        self, workflow_id: int, on_build: BuildCallback | None = None
+    ) -> dict[str, Fork]:
+        """Scans successful runs of the workflow, newest first, to find the
+        latest build of each live branch.
+
+        Runs created before the artifact retention window (plus the period in
+        which a run may be re-run) cannot have unexpired artifacts, so they are
+        not fetched at all; nor are artifacts looked up for runs which finished
+        before the retention window. If early termination is enabled, the scan
+        also stops once every live branch of the default repository, and every
+        live branch seen in a run from any other fork, has an unexpired build.
+        Note that a never-built branch in the default repository keeps the scan
+        going, as does any branch whose only builds have expired."""
+        artifacts: dict[str, Fork] = {}
+        # (owner, branch) pairs that do not yet have an unexpired build
+        unresolved: set[tuple[str, str]] = set()
+        url, params = self.workflow_runs_query(workflow_id, per_page=100)
+        logging.info("Scanning workflow runs created %s", params["created"])
+        pages = PageCount()
+        artifact_index = self.list_artifacts()
+        runs = self.api.paginate(
+            url,
+            params=params,
+            item_key="workflow_runs",
+            page_count=pages,
+            prefetch=not self.early_termination,
+        )
+
+        # Runs are processed one at a time, exactly as if every request were
+        # made in turn, but branch listings for new forks and likely artifact
+        # lookups for each page of runs are submitted to a thread pool in
+        # advance.
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.api.concurrency
+        ) as executor:
+            for page in itertools.batched(runs, params["per_page"]):
+                fork_branches = self.submit_branch_listings(
+                    executor,
+                    dict(
+                        (
+                            run["head_repository"]["owner"]["login"],
+                            run["head_repository"]["full_name"],
+                        )
+                        for run in page
+                        if run["head_repository"] is not None
+                        and run["head_repository"]["owner"]["login"] not in artifacts
+                    ),
                 )
-                artifacts[owner_label] = fork
+                lookups: dict[int, concurrent.futures.Future] = {}
+                self.look_ahead(executor, page, 0, artifacts, artifact_index, lookups)
+
+                for i, run in enumerate(page):
+                    head_repository = run["head_repository"]
+                    if head_repository is None:
+                        logging.debug(
+                            "Ignoring workflow run %s from deleted fork",
+                            run["html_url"],
+                        )
+                        continue
+
+                    owner_label = head_repository["owner"]["login"]
+                    try:
+                        fork = artifacts[owner_label]
+                    except KeyError:
+                        fork = Fork(
+                            live_branches={
+                                branch["name"]: Branch(info=branch, build=None)
+                                for branch in fork_branches[owner_label]()
+                            }
+                        )
+                        artifacts[owner_label] = fork
+                        if owner_label == self.default_org:
+                            unresolved.update(
+                                (owner_label, branch_name)
+                                for branch_name in fork.live_branches
+                            )
+
+                    branch_name = run["head_branch"]
+                    try:
+                        branch = fork.live_branches[branch_name]
+                    except KeyError:
+                        logging.debug(
+                            "Ignoring artifact for deleted branch %s/%s",
+                            owner_label,
+                            branch_name,
+                        )
+                        lookups.pop(i, None)
+                        continue
+
+                    if self.wants_artifact(branch, run):
+                        if i not in lookups:
+                            lookups[i] = executor.submit(
+                                self.find_run_artifact, run, artifact_index
+                            )
+                        self.merge_artifact(branch, run, lookups.pop(i).result())
+                        if (
+                            on_build
+                            and branch.build
+                            and not branch.build.artifact["expired"]
+                        ):
+                            on_build(owner_label, branch)
+                        self.look_ahead(
+                            executor, page, i + 1, artifacts, artifact_index, lookups
+                        )
+                    elif self.is_run_too_old(run):
+                        logging.debug(
+                            "Not looking for artifacts of %s, which is too old",
+                            run["html_url"],
+                        )
+                    lookups.pop(i, None)
+
+                    if branch.build and not branch.build.artifact["expired"]:
+                        unresolved.discard((owner_label, branch_name))
+                    else:
+                        unresolved.add((owner_label, branch_name))
+
+                    if self.early_termination and not unresolved:
+                        break
+                else:
+                    continue
 
-            branch_name = run["head_branch"]
-            try:
-                branch = fork.live_branches[branch_name]
-            except KeyError:
-                logging.debug(
-                    "Ignoring artifact for deleted branch %s/%s",
-                    owner_label,
-                    branch_name,
+                logging.info(
+                    "Every live branch has an unexpired build; stopped after "
+                    "%d page(s) of workflow runs, skipping %s more",
+                    pages.fetched,
+                    pages.remaining if pages.remaining is not None else "unknown",
                 )
+                for future in lookups.values():
+                    future.cancel()
+                break
+
+        return artifacts
+
+    def look_ahead(
+        self,
+        executor: concurrent.futures.Executor,
+        page: tuple[dict, ...],
+        start: int,
+        artifacts: dict[str, Fork],
+        index: ArtifactIndex,
+        lookups: dict[int, concurrent.futures.Future],
+    ) -> None:
+        """Submits artifact lookups for runs in page from start onwards which
+        will probably be needed: that is, the next run on each branch not
+        known to be deleted or to have an unexpired build, unless a lookup is
+        already pending for that branch."""
+        pending = {
+            (page[j]["head_repository"]["owner"]["login"], page[j]["head_branch"])
+            for j in lookups
+        }
+        for j in range(start, len(page)):
+            run = page[j]
+            if run["head_repository"] is None:
                 continue
 
-            if not branch.build or branch.build.artifact["expired"]:
-                artifact = self.find_artifact(run["artifacts_url"])
-                if not artifact:
+            owner_label = run["head_repository"]["owner"]["login"]
+            key = (owner_label, run["head_branch"])
+            branch = None
+            if fork := artifacts.get(owner_label):
+                branch = fork.live_branches.get(run["head_branch"])
+                if branch is None:
                     continue
 
-                if not branch.build or (
-                    branch.build.artifact["expired"] and not artifact["expired"]
-                ):
-                    branch.build = Build(workflow_run=run, artifact=artifact)
-                # TODO: You might hope that you could fetch
-                # https://api.github.com/repos/{repo}/actions/runs/{artifact['workflow_run']['id']}
-                # and inspect the pull_requests property to find the corresponding PR for each branch.
-                # But as discussed at https://github.com/orgs/community/discussions/25220 that
-                # property is always empty for builds from forks.
-
-        return artifacts
+            if key not in pending and self.wants_artifact(branch, run):
+                lookups[j] = executor.submit(self.find_run_artifact, run, index)
+                pending.add(key)
 
     def get_latest_built_releases(self) -> tuple[Release | None, Release | None]:
         """Fetches data on the latest release that has an asset that looks like a web build.
@@ -346,21 +2900,82 @@ class AmalgamatePages:
         url: str,
         dest_dir: pathlib.Path,
         headers: dict[str, str] | None = None,
-    ) -> int:
-        size: int = 0
-        with tempfile.TemporaryFile() as f:
-            with self.api.session.get(url, headers=headers, stream=True) as response:
-                response.raise_for_status()
-                shutil.copyfileobj(response.raw, f)
+        deduplicator: GodotDeduplicator | None = None,
+    ) -> dict[str, Member]:
+        """Returns the extracted members of the archive.
+
+        If a file which deduplicator wants has the same size and CRC-32 as
+        exactly one file it already has, and partial downloads are enabled, it
+        is not downloaded at all, and the existing copy is linked in its place.
+        Failing that, if its size and CRC-32 match any file it already has, it
+        is hashed as it is extracted, and if it is a copy, the existing copy is
+        linked in its place and the extracted one discarded."""
+
+        def is_known(member: zipfile.ZipInfo) -> bool:
+            return (
+                deduplicator is not None
+                and deduplicator.wants(member.filename)
+                and is_safe_member(member)
+                and deduplicator.has_one(member.file_size, member.CRC)
+            )
 
-            with zipfile.ZipFile(f) as zip_file:
-                for member in zip_file.infolist():
-                    size += member.file_size
-                    zip_file.extract(member, dest_dir)
+        members: dict[str, Member] = {}
+        # Skipped members which could not be linked after all
+        missing: list[zipfile.ZipInfo] = []
+        if deduplicator and self.partial_downloads:
+            archive, skipped = self.api.download_zip(url, headers, skip=is_known)
+        else:
+            archive, skipped = self.api.download(url, headers=headers), set()
+
+        with archive as f, zipfile.ZipFile(f) as zip_file:
+            for member in zip_file.infolist():
+                members[member.filename] = Member(member.file_size, member.CRC)
+                if (
+                    deduplicator
+                    and deduplicator.wants(member.filename)
+                    and is_safe_member(member)
+                    and (
+                        member.filename in skipped
+                        or deduplicator.may_have(member.file_size, member.CRC)
+                    )
+                ):
+                    path = dest_dir / member.filename
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    if member.filename in skipped:
+                        if linked := deduplicator.link(
+                            member.file_size, member.CRC, None, path
+                        ):
+                            logging.debug("Linked existing copy of %s", path)
+                            members[member.filename].sha256 = linked
+                        else:
+                            missing.append(member)
+                        continue
+
+                    extracted, sha256_hash = extract_hashing(zip_file, member, path)
+                    members[member.filename].sha256 = sha256_hash
+                    if deduplicator.link(
+                        member.file_size, member.CRC, sha256_hash, path
+                    ):
+                        logging.debug("Linked existing copy of %s", path)
+                        extracted.unlink()
+                    else:
+                        extracted.replace(path)
+                    continue
+
+                zip_file.extract(member, dest_dir)
 
-        return size
+        if missing:
+            logging.info("Downloading all of %s after all", url)
+            with self.api.download(url, headers=headers) as f:
+                with zipfile.ZipFile(f) as zip_file:
+                    for member in missing:
+                        zip_file.extract(member, dest_dir)
 
-    def download_release(self, release: Release, dest_dir: pathlib.Path) -> int:
+        return members
+
+    def release_download(
+        self, release: Release, dest_dir: pathlib.Path, rank: tuple
+    ) -> Download:
         # Downloading a release asset requires setting the Accept header to
         # application/octet-stream, or else you just get the JSON
         # description of the asset back.
@@ -370,12 +2985,165 @@ class AmalgamatePages:
         # However, setting Accept: application/octet-stream for build
         # artifacts does not work! So we need a different Accept header in
         # the two cases.
-        url = release.asset["url"]
-        headers = {"Accept": "application/octet-stream"}
-        return self.download_and_extract(url, dest_dir, headers=headers)
+        return Download(
+            label=release.data["name"] or release.data["tag_name"],
+            url=release.asset["url"],
+            dest_dir=dest_dir,
+            size=release.asset["size"],
+            rank=rank,
+            key=BuildStore.asset_key(release.asset),
+            headers={"Accept": "application/octet-stream"},
+            digest=release.asset.get("digest"),
+        )
+
+    def list_build(
+        self, url: str, key: str, headers: dict[str, str] | None = None
+    ) -> dict[str, Member] | None:
+        """Lists the files in the build's archive for SitePlanner, unless the
+        build is in the build store, which already knows them."""
+        if self.build_store and self.build_store.members(key) is not None:
+            return None
+        return self.api.list_zip(url, headers)
+
+    def fetch_build(self, download: Download, assembly: Assembly) -> int:
+        """Puts a build in place, deduplicates it against the builds placed so
+        far, and returns its extracted size.
+
+        If the previous run left the same build in the same place, and did not
+        share any of its files, it is left alone. Otherwise the build is linked
+        from the store, or downloaded and extracted into it once it fits in the
+        download budget."""
+        store = assembly.store
+        site_path = str(download.dest_dir.relative_to(assembly.dest_dir))
+        members = store.get(download.key)
+
+        if (
+            members is not None
+            and assembly.previous is not None
+            and assembly.previous.builds.get(site_path) == download.key
+            and site_path not in assembly.previous.shared
+        ):
+            logging.info("Leaving %s in place", download.label)
+            self.readd_build(download, assembly, members)
+            assembly.record(site_path, download.key, members)
+            return sum(member.size for member in members.values())
+
+        assembly.clear(site_path)
+        if members is None:
+
+            def extract(dest_dir: pathlib.Path) -> dict[str, Member]:
+                return self.download_and_extract(
+                    download.url,
+                    dest_dir,
+                    headers=download.headers,
+                    deduplicator=assembly.deduplicator,
+                )
+
+            assembly.budget.acquire(download.size)
+            try:
+                logging.info("Fetching %s from %s", download.label, download.url)
+                members = store.put(download.key, extract)
+            finally:
+                assembly.budget.release(download.size)
+        else:
+            logging.info("Using stored copy of %s", download.label)
+
+        link_tree(store.tree(download.key), download.dest_dir)
+
+        for filename, member in members.items():
+            if assembly.deduplicator.wants(filename):
+                assembly.deduplicator.add(
+                    download.dest_dir / filename,
+                    (*download.rank, filename),
+                    member.size,
+                    member.crc32,
+                    member.sha256,
+                )
+        assembly.record(site_path, download.key, members)
+        return sum(member.size for member in members.values())
+
+    def readd_build(
+        self, download: Download, assembly: Assembly, members: dict[str, Member]
+    ) -> None:
+        """Adds a build left in place by a previous run to the deduplicator,
+        using what the previous run recorded rather than reading it again."""
+        assert self.build_store is not None and assembly.previous is not None
+        tree = self.build_store.tree(download.key)
+
+        for filename, member in members.items():
+            if not assembly.deduplicator.wants(filename):
+                continue
+
+            path = download.dest_dir / filename
+            rank = (*download.rank, filename)
+            wasm = assembly.previous.wasms[str(path.relative_to(assembly.dest_dir))]
+            if wasm["target"] is None:
+                assembly.deduplicator.add(
+                    path, rank, member.size, member.crc32, wasm["sha256"]
+                )
+                continue
+
+            # The previous run removed the file along with any companions
+            # which the target also had.
+            parent = pathlib.PurePosixPath(filename).parent
+            removed = [filename] + [
+                name
+                for suffix in ENGINE_COMPANIONS
+                if (name := str(parent / f"index{suffix}")) in members
+                and not (download.dest_dir / name).exists()
+            ]
+
+            def restore(
+                removed: list[str] = removed,
+                index_html: str = str(parent / "index.html"),
+            ) -> None:
+                for name in removed + [index_html]:
+                    link_file(tree / name, download.dest_dir / name)
+
+            assembly.deduplicator.defer(
+                path,
+                rank,
+                member.size,
+                member.crc32,
+                wasm["sha256"],
+                assembly.dest_dir / wasm["target"],
+                sum(members[name].size for name in removed),
+                restore,
+            )
+
+    def alias_build(
+        self, download: Download, target: Download, assembly: Assembly
+    ) -> None:
+        """Replaces a build, if it has been put in place, with a redirect to an
+        identical build elsewhere in the site."""
+        site_path = str(download.dest_dir.relative_to(assembly.dest_dir))
+        target_path = str(target.dest_dir.relative_to(assembly.dest_dir))
+        logging.info("%s is identical to %s", download.label, target.label)
+
+        assembly.clear(site_path)
+        if (names := assembly.manifest.files.pop(site_path, None)) is not None:
+            del assembly.manifest.builds[site_path]
+            assembly.deduplicator.discard(
+                download.dest_dir / name
+                for name in names
+                if assembly.deduplicator.wants(name)
+            )
+            assembly.remove(site_path, names)
+
+        relative_path = str(
+            target.dest_dir.relative_to(download.dest_dir, walk_up=True)
+        )
+        self.render_template(
+            "redirect.html",
+            download.dest_dir / "index.html",
+            {"target": quote(relative_path.removesuffix("/") + "/")},
+        )
+        assembly.manifest.aliases[site_path] = target_path
 
     def render_template(self, name: str, target: pathlib.Path, context: dict) -> None:
         template = self.jinja_env.get_template(name)
+        # The target may be a hard link into the build store
+        target.unlink(missing_ok=True)
         with target.open("w") as f:
             stream = template.stream(context)
             # TemplateStream.dump expects str | IO[bytes]
@@ -403,174 +3171,387 @@ class AmalgamatePages:
                 pull_request = pull_requests.get(f"{org}:{branch.name}")
                 yield org, branch, pull_request
 
-    def deduplicate_godot_artifacts(self, dest_dir: pathlib.Path) -> int:
-        """Assuming each branch is a Godot web build named
-        index.{html,pck,wasm}, deduplicates index.wasm where possible. Gnarly
-        but functional."""
-        wasms = {}
-        deduplicated_bytes = 0
-
-        for dirpath, _dirnames, filenames in dest_dir.walk():
-            if "index.wasm" not in filenames:
-                continue
-
-            path = dirpath / "index.wasm"
-            sha256_hash = sha256(path.read_bytes()).hexdigest()
-
-            try:
-                target = wasms[sha256_hash]
-            except KeyError:
-                logging.debug("%s has new hash %s", path, sha256_hash)
-                wasms[sha256_hash] = path
-                continue
-
-            logging.debug(
-                "%s has duplicate hash %s, target is %s", path, sha256_hash, target
-            )
-
-            # Typically the target will be at the root of the site, but it could
-            # be a sibling, e.g. latest release is Godot 4.6, but main and 1 or
-            # more branches are 4.7.
-            target_dir = target.parent.relative_to(dirpath, walk_up=True)
-            index_html = dirpath / "index.html"
-            lines = index_html.read_text().splitlines()
-
-            for i, line in enumerate(lines):
-                if match := re.match(r"^const GODOT_CONFIG = (.*);$", line):
-                    break
-            else:
-                logging.warning(
-                    "Could not find GODOT_CONFIG in %s",
-                    index_html.relative_to(dest_dir),
-                )
-                continue
-
-            # Although not all JavaScript source is valid JSON, we happen to
-            # know that Godot fills this value in using its JSON serializer.
-            config = json.loads(match.group(1))
-
-            # If mainPack is not explicitly set, it defaults to a path
-            # derived from executable, which we are about to change.
-            config.setdefault("mainPack", config["executable"] + ".pck")
-
-            # Overwrite the executable path (which is given without the .wasm
-            # suffix for some reason) and update the file size table (which uses
-            # the suffix).
-            exe = f"{str(target_dir)}/index"
-            config["executable"] = exe
-            config["fileSizes"][f"{exe}.wasm"] = config["fileSizes"].pop("index.wasm")
-
-            # Now patch the config file
-            config_json = json.dumps(config, separators=(",", ":"))
-            lines[i] = f"const GODOT_CONFIG = {config_json};"
-
-            logging.info(
-                "Updating %s: replacing index.wasm with %s",
-                index_html.relative_to(dest_dir),
-                target_dir / "index.wasm",
-            )
-            index_html.write_text("\n".join(lines))
-            deduplicated_bytes += path.stat().st_size
-            path.unlink()
+    def publish_priority(
+        self, org: str, branch: Branch, pull_request: PullRequest | None
+    ) -> tuple:
+        """Returns a sort key which orders branches by their claim to a place
+        in the site: the default branch, then branches with open pull
+        requests, then the rest, most recently updated first."""
+        assert branch.build is not None
+        is_default = org == self.default_org and branch.name == self.default_branch
+        updated_at = (
+            pull_request["updated_at"]
+            if pull_request
+            else branch.build.artifact["updated_at"]
+        )
+        return (
+            not is_default,
+            pull_request is None,
+            -dt.datetime.fromisoformat(updated_at).timestamp(),
+        )
 
-        return deduplicated_bytes
+    def branch_rank(self, org: str, branch_name: str) -> tuple:
+        """Returns a sort key which orders branches as iter_branches() does."""
+        return (
+            org != self.default_org,
+            org,
+            branch_name != self.default_branch,
+            branch_name,
+        )
 
     def run(self) -> None:
         self.get_default_repo_details()
+        if self.artifact_retention is None:
+            self.artifact_retention = self.get_artifact_retention()
+        logging.info("Artifacts are retained for %d days", self.artifact_retention.days)
 
-        latest_release, prerelease = self.get_latest_built_releases()
         latest_release_size: int | None = None
         prerelease_dir: pathlib.Path | None = None
         prerelease_size: int | None = None
 
-        workflow = self.find_workflow()
-        web_artifacts = self.find_latest_artifacts(workflow["id"])
-        pull_requests = self.list_pull_requests()
-
-        dest_dir = pathlib.Path(__file__).parent / "_build"
-        shutil.rmtree(dest_dir, ignore_errors=True)
-        dest_dir.mkdir(parents=True)
+        dest_dir = self.site_dir
+        manifest_path = dest_dir.with_suffix(".json")
+        # Builds left by the previous run can only be reused if they can be
+        # restored from the build store.
+        previous = (
+            SiteManifest.load(manifest_path)
+            if self.build_store and dest_dir.is_dir()
+            else None
+        )
+        # If this run fails, the next one must start from scratch.
+        manifest_path.unlink(missing_ok=True)
+        if previous is None:
+            shutil.rmtree(dest_dir, ignore_errors=True)
+            dest_dir.mkdir(parents=True)
+            logging.info("Assembling site at %s", dest_dir)
+        else:
+            logging.info("Updating site at %s", dest_dir)
+        branches_dir = dest_dir / "branches"
+        branches_dir.mkdir(exist_ok=True)
 
-        logging.info("Assembling site at %s", dest_dir)
-        have_toplevel_build = False
+        statuses: list[StatusData] = []
+        items = []
 
-        if latest_release is not None:
-            latest_release_size = self.download_release(latest_release, dest_dir)
-            have_toplevel_build = True
+        hash_cache = HashCache(
+            self.api.cache_dir / "hashes.json" if self.api.cache_dir else None
+        )
 
-        if prerelease is not None:
-            if have_toplevel_build:
-                prerelease_dir = dest_dir / "prerelease"
-                prerelease_dir.mkdir()
-            else:
-                prerelease_dir = dest_dir
-                have_toplevel_build = True
-            prerelease_size = self.download_release(prerelease, prerelease_dir)
+        # Builds are downloaded, extracted and deduplicated in the background
+        # as soon as they are found, while discovery carries on. Only
+        # rendering the templates waits for all of them.
+        # Without a build store, builds are still extracted into a scratch
+        # store for the length of the run, so that a build can be put in place
+        # again as a copy of an identical one without downloading it twice.
+        scratch_dir = dest_dir.with_name(f"{dest_dir.name}.scratch")
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        assembly = Assembly(
+            dest_dir,
+            ByteBudget(self.download_budget),
+            GodotDeduplicator(dest_dir, hash_cache),
+            previous,
+            self.build_store or BuildStore(scratch_dir),
+        )
+        branch_fetches: dict[
+            tuple[str, str], tuple[pathlib.Path, concurrent.futures.Future[int]]
+        ] = {}
+        branch_fetches_lock = threading.Lock()
+        # With a size budget, branches are only fetched once every build is
+        # known and those which fit have been chosen.
+        planner = (
+            SitePlanner(self.site_budget, self.build_store)
+            if self.site_budget is not None
+            else None
+        )
+        # The first build found with each digest, and the others found later,
+        # which are not fetched
+        digest_fetches: dict[str, tuple[Download, concurrent.futures.Future[int]]] = {}
+        aliases: dict[str, list[Download]] = collections.defaultdict(list)
+        digest_lock = threading.Lock()
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.api.concurrency
+        ) as executor:
+
+            def fetch(download: Download) -> concurrent.futures.Future[int]:
+                """Starts fetching the build, unless an identical build is
+                already being fetched, and returns the future extracted size."""
+                with digest_lock:
+                    if download.digest in digest_fetches:
+                        aliases[download.digest].append(download)
+                        return digest_fetches[download.digest][1]
+
+                    future = executor.submit(self.fetch_build, download, assembly)
+                    if download.digest is not None:
+                        digest_fetches[download.digest] = download, future
+                    return future
+
+            def fetch_branch(
+                org: str, branch: Branch
+            ) -> tuple[pathlib.Path, concurrent.futures.Future[int]]:
+                """Starts fetching the branch's build into its place in the
+                site, unless that has already started. Returns the directory
+                and the future extracted size."""
+                assert branch.build is not None
+                key = (org, branch.name)
+                with branch_fetches_lock:
+                    if key in branch_fetches:
+                        return branch_fetches[key]
+
+                    if (
+                        org == self.default_org
+                        and branch.name == self.default_branch
+                        and not have_release
+                    ):
+                        branch_dir = dest_dir
+                    else:
+                        # TODO: Use colon form in directory name, avoiding
+                        # intermediate directory with no index?
+                        branch_dir = branches_dir / org / branch.name
+                        branch_dir.mkdir(parents=True, exist_ok=True)
+
+                    branch_fetches[key] = branch_dir, fetch(
+                        Download(
+                            label=f"{org}:{branch.name} export",
+                            url=branch.build.artifact["archive_download_url"],
+                            dest_dir=branch_dir,
+                            size=branch.build.artifact["size_in_bytes"],
+                            rank=(2, *self.branch_rank(org, branch.name)),
+                            key=BuildStore.artifact_key(branch.build.artifact),
+                            digest=branch.build.artifact.get("digest"),
+                        )
+                    )
+                    return branch_fetches[key]
+
+            def on_build(org: str, branch: Branch) -> None:
+                if planner is not None:
+                    return
+
+                # Skip builds which will be ignored below. With the GraphQL
+                # backend, whether a branch without an open pull request has
+                # a closed one is only known once discovery has finished.
+                pr = pull_requests.get(f"{org}:{branch.name}")
+                is_default = (
+                    branch.name == self.default_branch and org == self.default_org
+                )
+                if (
+                    is_default
+                    or (pr is None and self.discovery_backend == "rest")
+                    or (pr is not None and pr["state"] != "closed")
+                ):
+                    fetch_branch(org, branch)
 
-        statuses: list[StatusData] = []
-        items = []
-        branches_dir = dest_dir / "branches"
-        branches_dir.mkdir()
-
-        for org, branch, pr in self.iter_branches(web_artifacts, pull_requests):
-            is_default = branch.name == self.default_branch and org == self.default_org
-            item: dict[str, Any] = {
-                "org": org,
-                "name": branch.name,
-                "is_default": is_default,
-                "pull_request": None,
-                "build": branch.build,
-            }
-            status = StatusData(None, None, None)
+            try:
+                with self.api.phase("discovery"):
+                    latest_release, prerelease = self.get_latest_built_releases()
+                    have_release = latest_release is not None or prerelease is not None
+
+                    # Releases are always published, but count towards the
+                    # size budget.
+                    if latest_release is not None:
+                        download = self.release_download(latest_release, dest_dir, (0,))
+                        if planner is not None:
+                            planner.admit(
+                                download.size,
+                                download.key,
+                                download.digest,
+                                force=True,
+                                listed=self.list_build(
+                                    download.url, download.key, download.headers
+                                ),
+                            )
+                        latest_release_fetch = fetch(download)
+
+                    if prerelease is not None:
+                        if latest_release is not None:
+                            prerelease_dir = dest_dir / "prerelease"
+                            prerelease_dir.mkdir(exist_ok=True)
+                        else:
+                            prerelease_dir = dest_dir
+                        download = self.release_download(
+                            prerelease, prerelease_dir, (1,)
+                        )
+                        if planner is not None:
+                            planner.admit(
+                                download.size,
+                                download.key,
+                                download.digest,
+                                force=True,
+                                listed=self.list_build(
+                                    download.url, download.key, download.headers
+                                ),
+                            )
+                        prerelease_fetch = fetch(download)
+
+                    workflow = self.find_workflow()
+                    pull_requests = self.list_pull_requests()
+                    web_artifacts = self.discover_artifacts(
+                        workflow["id"], pull_requests, on_build=on_build
+                    )
+                    if self.discovery_backend == "graphql":
+                        pull_requests.update(
+                            self.find_closed_pull_requests_graphql(
+                                f"{org}:{branch.name}"
+                                for org, fork in web_artifacts.items()
+                                for branch in fork.live_branches.values()
+                                if branch.build
+                                and f"{org}:{branch.name}" not in pull_requests
+                            )
+                        )
+
+                have_toplevel_build = have_release
+                size_setters: list[
+                    tuple[Callable[[int], None], concurrent.futures.Future[int]]
+                ] = []
+                candidates: list[tuple[str, Branch, dict[str, Any], StatusData]] = []
+
+                def publish(
+                    org: str, branch: Branch, item: dict[str, Any], status: StatusData
+                ) -> bool:
+                    """Fetches the branch's build and fills in its item and
+                    status. Returns whether it is the top-level build."""
+                    assert branch.build is not None
+                    branch_dir, future = fetch_branch(org, branch)
+                    size_setters.append(
+                        (functools.partial(item.__setitem__, "size"), future)
+                    )
 
-            if pr and not is_default:
-                item["pull_request"] = pr
-                status.comments_url = pr["comments_url"]
-                if pr["state"] == "closed":
-                    logging.info(
-                        "Ignoring branch %s:%s; newest pull request %s is closed",
-                        org,
-                        branch.name,
-                        pr["url"],
+                    relative_path = str(
+                        branch_dir.relative_to(branches_dir, walk_up=True)
+                    )
+                    # The trailing slash is significant. GitHub Pages serves a
+                    # redirect to the trailing-slash version, but in the edge case
+                    # where the directory name contains a character that must be
+                    # URL-escaped, the character gets mangled.
+                    # See commit 2ba7617658bd089015aeb39dd9e190a788bd12cf.
+                    if not relative_path.endswith("/"):
+                        relative_path += "/"
+                    item["relative_path"] = relative_path
+
+                    build_url = "{}{}/".format(
+                        self.base_url,
+                        quote(str(branch_dir.relative_to(dest_dir))),
                     )
+                    status.build_url = build_url
+                    status.head_sha = branch.build.workflow_run["head_sha"]
                     statuses.append(status)
-                    continue
-
-            if branch.build and not branch.build.artifact["expired"]:
-                url = branch.build.artifact["archive_download_url"]
-                logging.info("Fetching %s:%s export from %s", org, branch.name, url)
+                    return branch_dir == dest_dir
 
-                if is_default and not have_toplevel_build:
-                    branch_dir = dest_dir
-                    have_toplevel_build = True
-                else:
-                    # TODO: Use colon form in directory name, avoiding
-                    # intermediate directory with no index?
-                    branch_dir = branches_dir / org / branch.name
-                    branch_dir.mkdir(parents=True)
-
-                item["size"] = self.download_and_extract(url, branch_dir)
-                relative_path = str(branch_dir.relative_to(branches_dir, walk_up=True))
-                # The trailing slash is significant. GitHub Pages serves a
-                # redirect to the trailing-slash version, but in the edge case
-                # where the directory name contains a character that must be
-                # URL-escaped, the character gets mangled.
-                # See commit 2ba7617658bd089015aeb39dd9e190a788bd12cf.
-                if not relative_path.endswith("/"):
-                    relative_path += "/"
-                item["relative_path"] = relative_path
-
-                build_url = "{}{}/".format(
-                    self.base_url,
-                    quote(str(branch_dir.relative_to(dest_dir))),
-                )
-                status.build_url = build_url
-                status.head_sha = branch.build.workflow_run["head_sha"]
-                statuses.append(status)
+                for org, branch, pr in self.iter_branches(web_artifacts, pull_requests):
+                    is_default = (
+                        branch.name == self.default_branch and org == self.default_org
+                    )
+                    item: dict[str, Any] = {
+                        "org": org,
+                        "name": branch.name,
+                        "is_default": is_default,
+                        "pull_request": None,
+                        "build": branch.build,
+                    }
+                    status = StatusData(None, None, None)
+
+                    if pr and not is_default:
+                        item["pull_request"] = pr
+                        status.comments_url = pr["comments_url"]
+                        if pr["state"] == "closed":
+                            logging.info(
+                                "Ignoring branch %s:%s; newest pull request %s is closed",
+                                org,
+                                branch.name,
+                                pr["url"],
+                            )
+                            statuses.append(status)
+                            continue
+
+                    if branch.build and not branch.build.artifact["expired"]:
+                        if planner is None:
+                            have_toplevel_build |= publish(org, branch, item, status)
+                        else:
+                            candidates.append((org, branch, item, status))
+
+                    items.append(item)
+
+                if planner is not None:
+                    candidates.sort(
+                        key=lambda c: self.publish_priority(
+                            c[0], c[1], c[2]["pull_request"]
+                        )
+                    )
 
-            items.append(item)
+                    def list_candidate(
+                        candidate: tuple[str, Branch, dict[str, Any], StatusData],
+                    ) -> dict[str, Member] | None:
+                        build = candidate[1].build
+                        assert build is not None
+                        return self.list_build(
+                            build.artifact["archive_download_url"],
+                            BuildStore.artifact_key(build.artifact),
+                        )
+
+                    # The archives are listed in the background, in order of
+                    # priority, while earlier ones are planned.
+                    listings = executor.map(list_candidate, candidates)
+                    for (org, branch, item, status), listed in zip(
+                        candidates, listings
+                    ):
+                        assert branch.build is not None
+                        artifact = branch.build.artifact
+                        reason = planner.admit(
+                            artifact["size_in_bytes"],
+                            BuildStore.artifact_key(artifact),
+                            artifact.get("digest"),
+                            listed=listed,
+                        )
+                        if reason is None:
+                            have_toplevel_build |= publish(org, branch, item, status)
+                        else:
+                            logging.info(
+                                "Not publishing %s:%s: %s", org, branch.name, reason
+                            )
+                            item["evicted"] = reason
+                            statuses.append(status)
+
+                if latest_release is not None:
+                    latest_release_size = latest_release_fetch.result()
+                if prerelease is not None:
+                    prerelease_size = prerelease_fetch.result()
+                for set_size, future in size_setters:
+                    set_size(future.result())
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
 
-        deduplicated_bytes = self.deduplicate_godot_artifacts(dest_dir)
+        assembly.deduplicator.finish()
+
+        # Of each set of identical builds, keep the one with the lowest rank,
+        # whichever was found first, and redirect the others to it.
+        aliased_bytes = 0
+        for digest, duplicates in aliases.items():
+            first, future = digest_fetches[digest]
+            canonical = min([first, *duplicates], key=lambda d: d.rank)
+            if canonical is not first:
+                self.fetch_build(canonical, assembly)
+                assembly.deduplicator.finish()
+            for download in [first, *duplicates]:
+                if download is not canonical:
+                    self.alias_build(download, canonical, assembly)
+            aliased_bytes += future.result() * len(duplicates)
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        deduplicated_bytes = assembly.deduplicator.deduplicated_bytes + aliased_bytes
+
+        # Every build which used the previous run's shared files has been
+        # put back in full, so they are shared afresh.
+        shutil.rmtree(dest_dir / SHARED_DIR, ignore_errors=True)
+        if self.share_files is not None:
+            sharer = FileSharer(dest_dir, self.share_files, hash_cache)
+            for site_path, name in sharer.share(assembly.manifest.files):
+                if site_path not in assembly.manifest.shared:
+                    assembly.manifest.shared.append(site_path)
+                assembly.emptied.add((dest_dir / site_path / name).parent)
+            deduplicated_bytes += sharer.shared_bytes
+
+        assembly.finish()
+        if self.build_store:
+            self.build_store.prune()
 
         if not have_toplevel_build:
             self.render_template(
@@ -592,6 +3573,9 @@ class AmalgamatePages:
                     else None
                 ),
                 "branches": items,
+                # Older builds are not looked for, so a branch without a build
+                # may still have been built before this
+                "artifact_retention_days": self.artifact_retention.days,
                 "deduplicated_bytes": deduplicated_bytes,
                 "generation_time": dt.datetime.now(tz=dt.timezone.utc),
                 "workflow_run_url": os.environ.get("WORKFLOW_RUN_URL"),
@@ -603,6 +3587,14 @@ class AmalgamatePages:
         if github_output:
             with open(github_output, "a") as f:
                 f.write(f"path={dest_dir}\n")
+                if self.build_store:
+                    # The build cache need only be saved if this changes
+                    f.write(f"builds_key={self.build_store.contents_key()}\n")
+
+        if self.build_store:
+            assembly.manifest.wasms = assembly.deduplicator.state(dest_dir)
+            assembly.manifest.dump(manifest_path)
+        hash_cache.save()
 
         logging.info("Site assembled at %s", dest_dir)
         StatusData.dump(statuses)
@@ -631,15 +3623,21 @@ def get_pages_config(session: requests.Session, repo: str) -> PagesConfig:
     )
 
 
+def env_flag(name: str, default: bool = False) -> bool:
+    match os.environ.get(name, "").lower():
+        case "true" | "1":
+            return True
+        case "false" | "0":
+            return False
+        case _:
+            return default
+
+
 def setup_logging() -> None:
     log_format = "+ %(asctime)s %(levelname)s %(name)s: %(message)s"
     date_format = "%H:%M:%S"
 
-    match os.environ.get("DEBUG", "false").lower():
-        case "true" | "1":
-            level = logging.DEBUG
-        case _:
-            level = logging.INFO
+    level = logging.DEBUG if env_flag("DEBUG") else logging.INFO
 
     logging.basicConfig(level=level, format=log_format, datefmt=date_format)
 
@@ -654,9 +3652,44 @@ def amalgamate(
     pages_config = get_pages_config(api.session, repo)
 
     amalgamate_pages = AmalgamatePages(
-        api, repo, pages_config, workflow_name, artifact_name
+        api,
+        repo,
+        pages_config,
+        workflow_name,
+        artifact_name,
+        early_termination=env_flag("EARLY_TERMINATION"),
+        artifact_retention=(
+            dt.timedelta(days=int(os.environ["ARTIFACT_RETENTION_DAYS"]))
+            if os.environ.get("ARTIFACT_RETENTION_DAYS")
+            else None
+        ),
+        discovery_strategy=os.environ.get("DISCOVERY_STRATEGY") or "auto",
+        discovery_backend=os.environ.get("DISCOVERY_BACKEND") or "rest",
+        download_budget=(
+            int(os.environ["DOWNLOAD_BUDGET_MB"]) * 1024**2
+            if os.environ.get("DOWNLOAD_BUDGET_MB")
+            else DEFAULT_DOWNLOAD_BUDGET
+        ),
+        build_store=(
+            BuildStore(api.cache_dir / "builds")
+            if api.cache_dir is not None and env_flag("CACHE_BUILDS", True)
+            else None
+        ),
+        partial_downloads=env_flag("PARTIAL_DOWNLOADS", True),
+        share_files=(SharingConfig.from_env() if env_flag("SHARE_FILES") else None),
+        site_budget=(
+            int(os.environ["SITE_BUDGET_MB"]) * 1024**2
+            if os.environ.get("SITE_BUDGET_MB")
+            else None
+        ),
+        site_dir=(
+            pathlib.Path(os.environ["SITE_DIR"])
+            if os.environ.get("SITE_DIR")
+            else DEFAULT_SITE_DIR
+        ),
     )
-    amalgamate_pages.run()
+    with api.phase("assembly"):
+        amalgamate_pages.run()
 
 
 def update_comment(
@@ -741,14 +3774,30 @@ def update_status(
     can_comment = True
     can_set_status = True
 
-    for data in StatusData.load():
-        if data.comments_url and can_comment:
-            can_comment = update_comment(
-                api, template, data.comments_url, data.build_url
-            )
+    with api.phase("update-status"):
+        for data in StatusData.load():
+            if data.comments_url and can_comment:
+                can_comment = update_comment(
+                    api, template, data.comments_url, data.build_url
+                )
+
+            if can_set_status and data.head_sha and data.build_url:
+                can_set_status = set_status(api, repo, data.head_sha, data.build_url)
+
+
+def get_cache_dir() -> pathlib.Path | None:
+    if cache_dir := os.environ.get("CACHE_DIR"):
+        return pathlib.Path(cache_dir)
+
+    if os.environ.get("CI") == "true":
+        return None
 
-        if can_set_status and data.head_sha and data.build_url:
-            can_set_status = set_status(api, repo, data.head_sha, data.build_url)
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    return (
+        pathlib.Path(xdg_cache_home)
+        if xdg_cache_home
+        else pathlib.Path.home() / ".cache"
+    ) / "godoctopus"
 
 
 def get_github_token() -> str:
@@ -777,7 +3826,7 @@ def main() -> None:
     parser_amalgamate.set_defaults(func=update_status)
 
     args = parser.parse_args()
-    with GitHubApi(api_token) as api:
+    with GitHubApi(api_token, get_cache_dir(), TransportConfig.from_env()) as api:
         try:
             args.func(api, repo, args)
         except ConfigurationError as e:
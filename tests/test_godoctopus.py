@@ -0,0 +1,1535 @@
+import collections.abc
+import datetime as dt
+import hashlib
+import io
+import itertools
+import json
+import pathlib
+import random
+import re
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+import unittest
+import urllib.parse
+from typing import Any, Callable, Iterator
+
+import requests
+import requests.adapters
+
+from godoctopus import (
+    API,
+    GRAPHQL_API,
+    MAX_RETRIES,
+    SHARED_DIR,
+    ZIP_TAIL_SIZE,
+    AmalgamatePages,
+    ArtifactIndex,
+    BuildStore,
+    FileSharer,
+    GitHubApi,
+    GodotDeduplicator,
+    HashCache,
+    Member,
+    RateLimiter,
+    SharingConfig,
+    SiteManifest,
+    SitePlanner,
+    extract_hashing,
+    rewrite_godot3_executable_name,
+    rewrite_godot3_start_game,
+    rewrite_godot_config,
+    zip_members,
+)
+
+# Answers a request with a status, a body and any extra headers
+Handler = Callable[[requests.PreparedRequest], tuple[int, Any, dict[str, str]]]
+
+
+class FakeTransport(requests.adapters.BaseAdapter):
+    """Answers requests from a handler rather than the network, recording
+    each request it is sent."""
+
+    def __init__(self, handler: Handler) -> None:
+        super().__init__()
+        self.handler = handler
+        self.sent: list[requests.PreparedRequest] = []
+
+    def send(self, request, **kwargs):  # type: ignore[no-untyped-def]
+        self.sent.append(request)
+        status, body, headers = self.handler(request)
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = (
+            body if isinstance(body, bytes) else json.dumps(body).encode()
+        )
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+def fake_api(handler: Handler) -> tuple[GitHubApi, FakeTransport]:
+    api = GitHubApi("token", None)
+    transport = FakeTransport(handler)
+    api.session.mount("https://", transport)
+    return api, transport
+
+
+def query(request: requests.PreparedRequest) -> dict[str, str]:
+    assert request.url is not None
+    return dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(request.url).query))
+
+
+def page(
+    request: requests.PreparedRequest, items: list, item_key: str | None = None
+) -> tuple[int, Any, dict[str, str]]:
+    """Answers a paginated listing request with the requested page of items,
+    wrapped in an object under item_key if given."""
+    params = query(request)
+    per_page = int(params.get("per_page", 30))
+    number = int(params.get("page", 1))
+    headers = {}
+    if number * per_page < len(items):
+        assert request.url is not None
+        base = request.url.split("?", 1)[0]
+        last = -(-len(items) // per_page)
+        headers["Link"] = ", ".join(
+            f'<{base}?{urllib.parse.urlencode({**params, "page": link_page})}>; rel="{rel}"'
+            for link_page, rel in ((number + 1, "next"), (last, "last"))
+        )
+    body: Any = items[(number - 1) * per_page : number * per_page]
+    if item_key:
+        body = {"total_count": len(items), item_key: body}
+    return 200, body, headers
+
+
+def run(run_id: int, created_at: str) -> dict:
+    return {"id": run_id, "created_at": created_at}
+
+
+def artifact(run_id: int, created_at: str) -> dict:
+    return {
+        "id": 100 + run_id,
+        "created_at": created_at,
+        "workflow_run": {"id": run_id},
+    }
+
+
+class TestArtifactIndex(unittest.TestCase):
+    # Newest first, as the API lists them
+    artifacts = [
+        artifact(3, "2026-01-03T00:00:10Z"),
+        artifact(2, "2026-01-02T00:00:10Z"),
+        artifact(1, "2026-01-01T00:00:10Z"),
+    ]
+
+    def setUp(self) -> None:
+        self.read = 0
+
+    def listing(self, fail_after: int | None = None) -> Iterator[dict]:
+        for i, item in enumerate(self.artifacts):
+            if i == fail_after:
+                raise requests.HTTPError("500 Server Error")
+            self.read += 1
+            yield item
+
+    def test_reads_only_as_far_as_needed(self) -> None:
+        index = ArtifactIndex(self.listing())
+        self.assertEqual(index.get(run(3, "2026-01-03T00:00:00Z")), self.artifacts[0])
+        self.assertEqual(self.read, 1)
+        self.assertEqual(index.get(run(2, "2026-01-02T00:00:00Z")), self.artifacts[1])
+        self.assertEqual(self.read, 2)
+
+    def test_miss_covered_once_read_past_run(self) -> None:
+        index = ArtifactIndex(self.listing())
+        # A run between the first two artifacts which produced none
+        missing = run(9, "2026-01-02T12:00:00Z")
+        self.assertFalse(index.covers(missing))
+        self.assertIsNone(index.get(missing))
+        self.assertEqual(self.read, 2)
+        self.assertTrue(index.covers(missing))
+
+    def test_miss_not_covered_before_reading(self) -> None:
+        index = ArtifactIndex(self.listing())
+        index.get(run(3, "2026-01-03T00:00:00Z"))
+        self.assertFalse(index.covers(run(9, "2026-01-01T12:00:00Z")))
+
+    def test_exhausted_listing_covers_everything(self) -> None:
+        index = ArtifactIndex(self.listing())
+        old = run(9, "2025-12-01T00:00:00Z")
+        self.assertIsNone(index.get(old))
+        self.assertEqual(self.read, 3)
+        self.assertTrue(index.covers(old))
+
+    def test_failed_listing_covers_nothing(self) -> None:
+        index = ArtifactIndex(self.listing(fail_after=1))
+        missing = run(9, "2026-01-02T12:00:00Z")
+        with self.assertLogs(level="WARNING"):
+            self.assertIsNone(index.get(missing))
+        self.assertFalse(index.covers(missing))
+        # Even for runs newer than what was read
+        self.assertFalse(index.covers(run(8, "2026-01-04T00:00:00Z")))
+
+
+def prepared(
+    method: str, url: str, query: str | None = None
+) -> requests.PreparedRequest:
+    json_body = None if query is None else {"query": query, "variables": {}}
+    return requests.Request(method, url, json=json_body).prepare()
+
+
+def response(
+    status: int, headers: dict[str, str] | None = None, text: str = ""
+) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = text.encode()
+    return response
+
+
+class TestRateLimiter(unittest.TestCase):
+    get = prepared("GET", f"{API}/repos/owner/game")
+    post = prepared("POST", f"{API}/repos/owner/game/statuses/0")
+    graphql_query = prepared("POST", GRAPHQL_API, "query { viewer { login } }")
+    graphql_mutation = prepared("POST", GRAPHQL_API, "mutation { addStar }")
+
+    def setUp(self) -> None:
+        self.limiter = RateLimiter()
+
+    def test_graphql_queries_are_not_mutations(self) -> None:
+        self.assertFalse(self.limiter.is_mutation(self.get))
+        self.assertTrue(self.limiter.is_mutation(self.post))
+        self.assertFalse(self.limiter.is_mutation(self.graphql_query))
+        self.assertTrue(self.limiter.is_mutation(self.graphql_mutation))
+
+    def test_server_errors_retried_unless_mutating(self) -> None:
+        for request in (self.get, self.graphql_query):
+            delay = self.limiter.retry_delay(request, response(502), 2)
+            assert delay is not None
+            self.assertLessEqual(delay, 4)
+        for request in (self.post, self.graphql_mutation):
+            self.assertIsNone(self.limiter.retry_delay(request, response(502), 0))
+
+    def test_client_errors_not_retried(self) -> None:
+        self.assertIsNone(self.limiter.retry_delay(self.get, response(404), 0))
+        self.assertIsNone(self.limiter.retry_delay(self.get, response(403), 0))
+
+    def test_gives_up_after_max_retries(self) -> None:
+        self.assertIsNone(
+            self.limiter.retry_delay(self.get, response(502), MAX_RETRIES)
+        )
+
+    def test_rate_limited_mutation_retried(self) -> None:
+        delay = self.limiter.retry_delay(
+            self.post, response(429, {"Retry-After": "30"}), 0
+        )
+        assert delay is not None
+        self.assertGreaterEqual(delay, 30)
+        self.assertLessEqual(delay, 31)
+
+    def test_waits_for_primary_rate_limit_reset(self) -> None:
+        headers = {
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": str(time.time() + 120),
+        }
+        delay = self.limiter.retry_delay(self.get, response(403, headers), 0)
+        assert delay is not None
+        self.assertGreater(delay, 119)
+        self.assertLess(delay, 123)
+
+    def test_gives_up_on_distant_rate_limit_reset(self) -> None:
+        headers = {
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": str(time.time() + 3600),
+        }
+        self.assertIsNone(self.limiter.retry_delay(self.get, response(403, headers), 0))
+
+    def test_secondary_rate_limit_waits_a_minute(self) -> None:
+        error = response(403, text="You have exceeded a secondary rate limit")
+        delay = self.limiter.retry_delay(self.get, error, 1)
+        assert delay is not None
+        self.assertGreaterEqual(delay, 120)
+
+
+class TestPrefetchPages(unittest.TestCase):
+    url = f"{API}/repos/owner/game/actions/artifacts"
+
+    def setUp(self) -> None:
+        self.items = list(range(1000))
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.api, self.transport = fake_api(self.handle)
+
+    def handle(self, request: requests.PreparedRequest) -> tuple[int, Any, dict]:
+        with self.lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        # Earlier pages take longer, so later ones finish first
+        time.sleep(0.02 / int(query(request).get("page", 1)))
+        with self.lock:
+            self.in_flight -= 1
+        return page(request, self.items, "artifacts")
+
+    def test_yields_items_in_order(self) -> None:
+        items = self.api.paginate(self.url, item_key="artifacts", prefetch=True)
+        self.assertEqual(list(items), self.items)
+        self.assertEqual(len(self.transport.sent), 10)
+        self.assertLessEqual(self.most_in_flight, self.api.concurrency)
+
+    def test_fetches_bounded_number_of_pages_ahead(self) -> None:
+        items = self.api.paginate(self.url, item_key="artifacts", prefetch=True)
+        assert isinstance(items, collections.abc.Generator)
+        # The first item of the second page
+        self.assertEqual(next(itertools.islice(items, 100, None)), 100)
+        # The first page, the second, and at most `concurrency` pages after it
+        self.assertLessEqual(len(self.transport.sent), 2 + self.api.concurrency)
+        items.close()
+        # No further pages are fetched once the caller stops
+        sent = len(self.transport.sent)
+        time.sleep(0.1)
+        self.assertEqual(len(self.transport.sent), sent)
+
+
+class TestFindBranchArtifacts(unittest.TestCase):
+    forks = 250
+
+    def setUp(self) -> None:
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        # Newest first: one run of main in each fork, then the default repo's
+        self.runs = [
+            {
+                "id": i,
+                "url": f"{API}/runs/{i}",
+                "html_url": f"https://github.com/runs/{i}",
+                "artifacts_url": f"{API}/runs/{i}/artifacts",
+                "created_at": (now - dt.timedelta(hours=i)).isoformat(),
+                "updated_at": (now - dt.timedelta(hours=i)).isoformat(),
+                "head_repository": {"full_name": f"fork{i}/game"},
+            }
+            for i in range(self.forks)
+        ]
+        self.runs.append(
+            {
+                **self.runs[0],
+                "id": self.forks,
+                "artifacts_url": f"{API}/runs/{self.forks}/artifacts",
+                "head_repository": {"full_name": "owner/game"},
+            }
+        )
+        api, self.transport = fake_api(self.handle)
+        self.pages = AmalgamatePages(
+            api,
+            "owner/game",
+            {},
+            "Export",
+            "web",
+            artifact_retention=dt.timedelta(days=90),
+        )
+        self.pages.repo_details = {"owner": {"login": "owner"}}
+
+    def handle(self, request: requests.PreparedRequest) -> tuple[int, Any, dict]:
+        assert request.url is not None
+        path = urllib.parse.urlsplit(request.url).path
+        if path.endswith("/runs"):
+            branch = query(request)["branch"]
+            return page(request, self.runs if branch == "main" else [], "workflow_runs")
+        run_id = int(path.split("/")[-2])
+        artifact = {"name": "web", "expired": False, "workflow_run": {"id": run_id}}
+        return page(request, [artifact], "artifacts")
+
+    def run_requests(self) -> list[str]:
+        return [
+            query(request)["branch"]
+            for request in self.transport.sent
+            if request.url and "/runs?" in request.url
+        ]
+
+    def pull_requests(self) -> dict[str, Any]:
+        return {
+            f"fork{i}:main": {
+                "url": f"{API}/pulls/{i}",
+                "state": "open",
+                "head": {"sha": f"{i}", "repo": {"full_name": f"fork{i}/game"}},
+            }
+            for i in range(self.forks)
+        }
+
+    def test_forks_share_listing_of_runs_on_same_branch_name(self) -> None:
+        found = self.pages.find_branch_artifacts(
+            1,
+            self.pull_requests(),
+            default_branches=[{"name": "main"}, {"name": "unbuilt"}],
+        )
+        # 251 runs of main at 100 per page, and one request for the other branch
+        self.assertEqual(sorted(self.run_requests()), ["main"] * 3 + ["unbuilt"])
+        for owner, fork in found.items():
+            build = fork.live_branches["main"].build
+            assert build is not None
+            self.assertEqual(
+                build.workflow_run["head_repository"]["full_name"], f"{owner}/game"
+            )
+        self.assertIsNone(found["owner"].live_branches["unbuilt"].build)
+
+    def test_lone_branch_fetches_newest_run_first(self) -> None:
+        self.runs.insert(0, self.runs.pop())
+        self.pages.find_branch_artifacts(1, {}, default_branches=[{"name": "main"}])
+        self.assertEqual(self.run_requests(), ["main"])
+
+    def test_lone_branch_pages_through_older_runs(self) -> None:
+        self.pages.find_branch_artifacts(1, {}, default_branches=[{"name": "main"}])
+        # The newest run on its own, then three pages of 100
+        self.assertEqual(self.run_requests(), ["main"] * 4)
+
+
+def pull_request_node(number: int, owner: str, ref: str, state: str) -> dict:
+    return {
+        "number": number,
+        "title": f"Pull request {number}",
+        "url": f"https://github.com/owner/game/pull/{number}",
+        "state": state,
+        "updatedAt": f"2020-01-{number:02}T00:00:00Z",
+        "headRefName": ref,
+        "headRefOid": f"{number:040}",
+        "headRepositoryOwner": {"login": owner},
+        "headRepository": {"nameWithOwner": f"{owner}/game"},
+    }
+
+
+class TestPullRequests(unittest.TestCase):
+    def setUp(self) -> None:
+        # Newest first, as they are listed
+        self.closed = [
+            pull_request_node(3, "bob", "main", "MERGED"),
+            pull_request_node(2, "alice", "main", "CLOSED"),
+            pull_request_node(1, "alice", "main", "CLOSED"),
+        ]
+        api, self.transport = fake_api(self.handle)
+        self.pages = AmalgamatePages(
+            api,
+            "owner/game",
+            {},
+            "Export",
+            "web",
+            artifact_retention=dt.timedelta(days=90),
+        )
+
+    def handle(self, request: requests.PreparedRequest) -> tuple[int, Any, dict]:
+        assert request.url is not None
+        if request.url.endswith("/graphql"):
+            assert request.body is not None
+            variables = json.loads(request.body)["variables"]
+            return (
+                200,
+                {
+                    "data": {
+                        "repository": {
+                            f"p{i}": {
+                                "pageInfo": {"hasNextPage": False},
+                                "nodes": [
+                                    node
+                                    for node in self.closed
+                                    if node["headRefName"] == variables[f"ref{i}"]
+                                ],
+                            }
+                            for i in range(len(variables) - 2)
+                        }
+                    }
+                },
+                {},
+            )
+
+        items = [
+            {
+                "number": node["number"],
+                "url": f"{API}/repos/owner/game/pulls/{node['number']}",
+                "state": "closed",
+                "updated_at": node["updatedAt"],
+                "head": {"label": f"{node['headRepositoryOwner']['login']}:main"},
+            }
+            for node in self.closed
+        ]
+        return page(request, items)
+
+    def test_rest_keeps_long_closed_pull_requests(self) -> None:
+        found = self.pages.list_pull_requests()
+        self.assertEqual(found["alice:main"]["number"], 2)
+        self.assertEqual(found["bob:main"]["number"], 3)
+
+    def test_graphql_finds_closed_pull_requests_for_labels(self) -> None:
+        found = self.pages.find_closed_pull_requests_graphql(
+            ["alice:main", "carol:main", "owner:feature"]
+        )
+        self.assertEqual(list(found), ["alice:main"])
+        self.assertEqual(found["alice:main"]["number"], 2)
+        self.assertEqual(found["alice:main"]["state"], "closed")
+        # Both branch names in one query
+        self.assertEqual(len(self.transport.sent), 1)
+
+
+def rest_pull_request(number: int, updated_at: str, state: str = "open") -> dict:
+    return {
+        "number": number,
+        "title": f"Pull request {number}",
+        "html_url": f"https://github.com/owner/game/pull/{number}",
+        "url": f"{API}/repos/owner/game/pulls/{number}",
+        "comments_url": f"{API}/repos/owner/game/issues/{number}/comments",
+        "state": state,
+        "updated_at": updated_at,
+        "head": {
+            "label": f"fork{number}:main",
+            "ref": "main",
+            "sha": f"{number:040}",
+            "repo": {"full_name": f"fork{number}/game", "private": False},
+        },
+    }
+
+
+class TestPullRequestIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        # Most recently updated first, as they are listed
+        self.pull_requests = [
+            rest_pull_request(i, f"2026-01-01T{23 - i // 60:02}:{59 - i % 60:02}:00Z")
+            for i in range(250)
+        ]
+        api, self.transport = fake_api(
+            lambda request: page(request, self.pull_requests)
+        )
+        self.pages = AmalgamatePages(api, "owner/game", {}, "Export", "web")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = pathlib.Path(tmp.name) / "pull-requests.json"
+
+    def update(self) -> dict[int, dict]:
+        self.transport.sent.clear()
+        return {
+            pr["number"]: pr for pr in self.pages.update_pull_request_index(self.path)
+        }
+
+    def test_lists_every_pull_request_without_index(self) -> None:
+        index = self.update()
+        self.assertEqual(sorted(index), list(range(250)))
+        self.assertEqual(len(self.transport.sent), 3)
+        # Only the fields which are used are kept
+        self.assertEqual(index[0]["head"]["repo"], {"full_name": "fork0/game"})
+
+    def test_stops_at_first_pull_request_not_updated_since(self) -> None:
+        self.update()
+        # Two pull requests are updated, and move to the top of the listing
+        updated = [self.pull_requests.pop(200), self.pull_requests.pop(100)]
+        for pr in updated:
+            pr["state"] = "closed"
+            pr["updated_at"] = "2026-01-02T00:00:00Z"
+        self.pull_requests[:0] = updated
+
+        index = self.update()
+        self.assertEqual(len(self.transport.sent), 1)
+        self.assertEqual(sorted(index), list(range(250)))
+        self.assertEqual(index[100]["state"], "closed")
+        self.assertEqual(index[200]["state"], "closed")
+        self.assertEqual(index[0]["state"], "open")
+
+    def test_ignores_invalid_index(self) -> None:
+        self.path.write_text("{")
+        with self.assertLogs(level="WARNING"):
+            index = self.update()
+        self.assertEqual(len(index), 250)
+
+
+# Excerpts of the HTML shells exported by each Godot version, as exported
+GODOT32_HTML = """\
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" lang="" xml:lang="">
+<head>
+	<meta charset="utf-8" />
+	<meta name="viewport" content="width=device-width, user-scalable=no" />
+	<title>Game</title>
+</head>
+<body>
+	<canvas id="canvas">
+		HTML5 canvas appears to be unsupported in the current browser.<br />
+		Please try updating or use a different browser.
+	</canvas>
+	<div id="status">
+		<div id="status-notice" class="godot" style="display: none;"></div>
+	</div>
+
+	<script type="text/javascript" src="index.js"></script>
+	<script type="text/javascript">//<![CDATA[
+
+		var engine = new Engine;
+		var setStatusMode;
+		var setStatusNotice;
+
+		(function() {
+
+			const EXECUTABLE_NAME = 'index';
+			const MAIN_PACK = 'index.pck';
+			const DEBUG_ENABLED = false;
+			const INDETERMINATE_STATUS_STEP_MS = 100;
+
+			var canvas = document.getElementById('canvas');
+			var initializing = true;
+
+			if (!Engine.isWebGLAvailable()) {
+				displayFailureNotice('WebGL not available');
+			} else {
+				setStatusMode('indeterminate');
+				engine.setCanvas(canvas);
+				engine.startGame(EXECUTABLE_NAME, MAIN_PACK).then(() => {
+					setStatusMode('hidden');
+					initializing = false;
+				}, displayFailureNotice);
+			}
+		})();
+	//]]></script>
+</body>
+</html>
+"""
+GODOT35_HTML = """\
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" lang="" xml:lang="">
+	<head>
+		<meta charset="utf-8" />
+		<meta name="viewport" content="width=device-width, user-scalable=no" />
+		<title>Game</title>
+	</head>
+	<body>
+		<canvas id="canvas">
+			HTML5 canvas appears to be unsupported in the current browser.<br />
+			Please try updating or use a different browser.
+		</canvas>
+
+		<script type="text/javascript" src="index.js"></script>
+		<script type="text/javascript">//<![CDATA[
+
+			const GODOT_CONFIG = {"args":[],"canvasResizePolicy":2,"executable":"index","experimentalVK":false,"fileSizes":{"index.pck":5,"index.wasm":600},"focusCanvas":true,"gdnativeLibs":[]};
+			var engine = new Engine(GODOT_CONFIG);
+
+			(function() {
+				const INDETERMINATE_STATUS_STEP_MS = 100;
+				var statusProgress = document.getElementById('status-progress');
+
+				const missing = Engine.getMissingFeatures();
+				if (missing.length !== 0) {
+					displayFailureNotice(missing.join('\\n'));
+				} else {
+					setStatusMode('indeterminate');
+					engine.startGame({
+						'onProgress': function (current, total) {
+							if (total > 0) {
+								statusProgressInner.style.width = current/total * 100 + '%';
+							}
+						},
+					}).then(() => {
+						setStatusMode('hidden');
+						initializing = false;
+					}, displayFailureNotice);
+				}
+			})();
+		//]]></script>
+	</body>
+</html>
+"""
+GODOT4_HTML = """\
+<!DOCTYPE html>
+<html lang="en">
+	<head>
+		<meta charset="utf-8">
+		<meta name="viewport" content="width=device-width, user-scalable=no, initial-scale=1.0">
+		<title>Game</title>
+	</head>
+	<body>
+		<canvas id="canvas">
+			Your browser does not support the canvas tag.
+		</canvas>
+
+		<script src="index.js"></script>
+		<script>
+const GODOT_CONFIG = {"args":[],"canvasResizePolicy":2,"ensureCrossOriginIsolationHeaders":true,"executable":"index","experimentalVK":false,"fileSizes":{"index.pck":5,"index.wasm":600},"focusCanvas":true,"gdextensionLibs":[],"serviceWorker":""};
+const GODOT_THREADS_ENABLED = false;
+const engine = new Engine(GODOT_CONFIG);
+
+(function () {
+	const statusOverlay = document.getElementById('status');
+	let initializing = true;
+
+	const missing = Engine.getMissingFeatures({
+		threads: GODOT_THREADS_ENABLED,
+	});
+	if (missing.length !== 0) {
+		displayFailureNotice(missing.join('\\n'));
+	} else {
+		setStatusMode('progress');
+		engine.startGame({
+			'onProgress': function (current, total) {
+				if (current > 0 && total > 0) {
+					statusProgress.value = current;
+					statusProgress.max = total;
+				}
+			},
+		}).then(() => {
+			setStatusMode('hidden');
+		}, displayFailureNotice);
+	}
+}());
+		</script>
+	</body>
+</html>
+"""
+# A custom Godot 3 shell which passes its options to startGame() itself
+GODOT3_CUSTOM_HTML = """\
+<script type="text/javascript" src="index.js"></script>
+<script type="text/javascript">
+	var engine = new Engine();
+	engine.startGame({
+		executable: 'index',
+		onProgress: (current, total) => console.log(current, total),
+	}).then(() => console.log('started'));
+</script>
+"""
+ENGINE = b"\0asm" + b"engine" * 100
+
+
+class GodotBuilds(unittest.TestCase):
+    """Lays out Godot web builds in a temporary site directory."""
+
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dest_dir = pathlib.Path(tmp.name)
+        self.deduplicator = GodotDeduplicator(self.dest_dir)
+
+    def build(
+        self, name: str, engine: bytes = ENGINE, files: dict[str, bytes] | None = None
+    ) -> pathlib.Path:
+        build_dir = self.dest_dir / name
+        build_dir.mkdir(parents=True)
+        files = {
+            "index.html": GODOT4_HTML.encode(),
+            "index.js": b"var Engine;",
+            "index.pck": name.encode(),
+            "index.wasm": engine,
+            **(files or {}),
+        }
+        for filename, content in files.items():
+            (build_dir / filename).write_bytes(content)
+        return build_dir / "index.wasm"
+
+    def add(self, path: pathlib.Path, rank: tuple) -> None:
+        content = path.read_bytes()
+        self.deduplicator.add(path, rank, len(content), zlib.crc32(content))
+
+    def config(self, build_dir: pathlib.Path) -> dict:
+        for line in (build_dir / "index.html").read_text().splitlines():
+            if line.startswith("const GODOT_CONFIG = "):
+                return json.loads(line.removeprefix("const GODOT_CONFIG = ")[:-1])
+        self.fail(f"No GODOT_CONFIG in {build_dir}")
+
+
+class TestGodotDeduplicator(GodotBuilds):
+    def test_later_copy_loads_earlier_one(self) -> None:
+        first = self.build("first")
+        second = self.build("second")
+        self.add(first, (0,))
+        self.add(second, (1,))
+
+        self.assertFalse(second.exists())
+        self.assertFalse((second.parent / "index.js").exists())
+        self.assertTrue((second.parent / "index.pck").exists())
+        config = self.config(second.parent)
+        self.assertEqual(config["executable"], "../first/index")
+        self.assertEqual(config["mainPack"], "index.pck")
+        self.assertIn(
+            'src="../first/index.js"', (second.parent / "index.html").read_text()
+        )
+        self.assertEqual(self.config(first.parent)["executable"], "index")
+        self.assertEqual(
+            self.deduplicator.deduplicated_bytes, len(ENGINE) + len(b"var Engine;")
+        )
+
+    def test_lower_ranked_copy_kept_whatever_the_order(self) -> None:
+        first = self.build("first")
+        second = self.build("second")
+        self.add(second, (1,))
+        self.add(first, (0,))
+
+        self.assertTrue(first.exists())
+        self.assertFalse(second.exists())
+        self.assertEqual(self.config(second.parent)["executable"], "../first/index")
+        self.assertEqual(self.config(first.parent)["executable"], "index")
+
+    def test_dependents_follow_kept_copy(self) -> None:
+        paths = [self.build(name) for name in ("first", "second", "third")]
+        self.add(paths[2], (2,))
+        self.add(paths[1], (1,))
+        self.add(paths[0], (0,))
+
+        for path in paths[1:]:
+            self.assertFalse(path.exists())
+            self.assertEqual(self.config(path.parent)["executable"], "../first/index")
+
+    def test_different_engines_left_alone(self) -> None:
+        first = self.build("first")
+        second = self.build("second", engine=ENGINE + b"!")
+        self.add(first, (0,))
+        self.add(second, (1,))
+
+        self.assertTrue(second.exists())
+        self.assertEqual(self.config(second.parent)["executable"], "index")
+        self.assertEqual(self.deduplicator.deduplicated_bytes, 0)
+
+
+class TestGodotDeduplicatorChecksums(GodotBuilds):
+    def test_file_without_duplicates_not_hashed(self) -> None:
+        self.add(self.build("first"), (0,))
+        self.add(self.build("second", engine=ENGINE + b"!"), (1,))
+        self.assertEqual(self.deduplicator.hash_cache.used, {})
+
+    def test_may_have_and_has_one(self) -> None:
+        size, crc32 = len(ENGINE), zlib.crc32(ENGINE)
+        self.assertFalse(self.deduplicator.may_have(size, crc32))
+        self.assertFalse(self.deduplicator.has_one(size, crc32))
+        self.add(self.build("first"), (0,))
+        self.assertTrue(self.deduplicator.may_have(size, crc32))
+        self.assertTrue(self.deduplicator.has_one(size, crc32))
+        self.assertFalse(self.deduplicator.may_have(size, crc32 ^ 1))
+
+    def test_link_by_size_and_crc32(self) -> None:
+        first = self.build("first")
+        self.add(first, (0,))
+        dest = self.dest_dir / "second" / "index.wasm"
+        dest.parent.mkdir()
+        size, crc32 = len(ENGINE), zlib.crc32(ENGINE)
+
+        self.assertIsNone(self.deduplicator.link(size, crc32 ^ 1, None, dest))
+        self.assertFalse(dest.exists())
+        linked = self.deduplicator.link(size, crc32, None, dest)
+        self.assertEqual(linked, hashlib.sha256(ENGINE).hexdigest())
+        self.assertTrue(dest.samefile(first))
+
+    def test_link_checks_hash_if_given(self) -> None:
+        self.add(self.build("first"), (0,))
+        dest = self.dest_dir / "second" / "index.wasm"
+        dest.parent.mkdir()
+        size, crc32 = len(ENGINE), zlib.crc32(ENGINE)
+        self.assertIsNone(self.deduplicator.link(size, crc32, "0" * 64, dest))
+        self.assertFalse(dest.exists())
+
+
+class TestGodotDeduplicatorCompanions(GodotBuilds):
+    def test_companions_shared_when_identical(self) -> None:
+        worker = {"index.worker.js": b"worker", "index.side.wasm": b"side"}
+        first = self.build("first", files=worker)
+        second = self.build("second", files=worker)
+        self.add(first, (0,))
+        self.add(second, (1,))
+
+        for name in ("index.wasm", "index.js", "index.worker.js", "index.side.wasm"):
+            self.assertFalse((second.parent / name).exists(), name)
+            self.assertTrue((first.parent / name).exists(), name)
+
+    def test_different_js_kept_and_loaded(self) -> None:
+        first = self.build("first")
+        second = self.build("second", files={"index.js": b"var Engine = 2;"})
+        self.add(first, (0,))
+        self.add(second, (1,))
+
+        self.assertFalse(second.exists())
+        self.assertEqual((second.parent / "index.js").read_bytes(), b"var Engine = 2;")
+        html = (second.parent / "index.html").read_text()
+        self.assertIn('src="index.js"', html)
+        self.assertEqual(self.config(second.parent)["executable"], "../first/index")
+
+    def test_different_companion_not_deduplicated(self) -> None:
+        first = self.build("first", files={"index.worker.js": b"worker"})
+        second = self.build("second", files={"index.worker.js": b"other worker"})
+        self.add(first, (0,))
+        with self.assertLogs(level="WARNING"):
+            self.add(second, (1,))
+
+        self.assertTrue(second.exists())
+        self.assertEqual(self.config(second.parent)["executable"], "index")
+        self.assertEqual(self.deduplicator.deduplicated_bytes, 0)
+
+    def test_companion_missing_from_kept_copy_not_deduplicated(self) -> None:
+        first = self.build("first")
+        second = self.build("second", files={"index.side.wasm": b"side"})
+        self.add(first, (0,))
+        with self.assertLogs(level="WARNING"):
+            self.add(second, (1,))
+
+        self.assertTrue(second.exists())
+        self.assertTrue((second.parent / "index.side.wasm").exists())
+
+    def test_identical(self) -> None:
+        first = self.build("first")
+        second = self.build("second")
+        third = self.build("third", engine=ENGINE[::-1])
+        self.assertTrue(self.deduplicator.identical(first, second))
+        self.assertFalse(self.deduplicator.identical(first, third))
+        self.assertFalse(
+            self.deduplicator.identical(first, first.parent / "index.worker.js")
+        )
+
+
+def godot_config(lines: list[str]) -> dict:
+    for line in lines:
+        if match := re.match(r"^\s*const GODOT_CONFIG = (.*);$", line):
+            return json.loads(match[1])
+    raise AssertionError("No GODOT_CONFIG")
+
+
+class TestConfigRewriters(unittest.TestCase):
+    def rewrite(self, html: str) -> tuple[list[str], list[str | None]]:
+        """Runs each rewriter on its own copy of html's lines, returning the
+        lines changed by whichever recognised them and what each returned."""
+        changed = html.splitlines()
+        results = []
+        for rewriter in (
+            rewrite_godot_config,
+            rewrite_godot3_start_game,
+            rewrite_godot3_executable_name,
+        ):
+            lines = html.splitlines()
+            results.append(rewriter(lines, "../first/index"))
+            if results[-1] is None:
+                self.assertEqual(lines, html.splitlines(), rewriter.__name__)
+            else:
+                changed = lines
+        return changed, results
+
+    def assert_only_changed(self, html: str, lines: list[str], *changed: str) -> None:
+        before = [line for line in html.splitlines() if line not in lines]
+        after = [line for line in lines if line not in html.splitlines()]
+        self.assertEqual(len(before), len(changed))
+        self.assertEqual([line.strip() for line in after], list(changed))
+
+    def test_godot4(self) -> None:
+        lines, results = self.rewrite(GODOT4_HTML)
+        self.assertEqual(results, ["index", None, None])
+        config = godot_config(lines)
+        self.assertEqual(config["executable"], "../first/index")
+        self.assertEqual(config["mainPack"], "index.pck")
+        self.assertEqual(
+            config["fileSizes"], {"index.pck": 5, "../first/index.wasm": 600}
+        )
+        self.assertTrue(config["ensureCrossOriginIsolationHeaders"])
+
+    def test_godot4_side_module(self) -> None:
+        html = GODOT4_HTML.replace(
+            '"index.wasm":600}', '"index.side.wasm":700,"index.wasm":600}'
+        )
+        lines, _ = self.rewrite(html)
+        self.assertEqual(
+            godot_config(lines)["fileSizes"],
+            {
+                "index.pck": 5,
+                "../first/index.wasm": 600,
+                "../first/index.side.wasm": 700,
+            },
+        )
+
+    def test_godot35(self) -> None:
+        lines, results = self.rewrite(GODOT35_HTML)
+        # Its call to startGame() only passes onProgress
+        self.assertEqual(results, ["index", None, None])
+        config = godot_config(lines)
+        self.assertEqual(config["executable"], "../first/index")
+        self.assertEqual(config["mainPack"], "index.pck")
+        self.assertEqual(config["gdnativeLibs"], [])
+
+    def test_godot32(self) -> None:
+        lines, results = self.rewrite(GODOT32_HTML)
+        self.assertEqual(results, [None, None, "index"])
+        self.assert_only_changed(
+            GODOT32_HTML, lines, 'const EXECUTABLE_NAME = "../first/index";'
+        )
+        self.assertIn("\t\t\tconst EXECUTABLE_NAME", "\n".join(lines))
+
+    def test_custom_start_game_across_lines(self) -> None:
+        lines, results = self.rewrite(GODOT3_CUSTOM_HTML)
+        self.assertEqual(results, [None, "index", None])
+        self.assert_only_changed(
+            GODOT3_CUSTOM_HTML,
+            lines,
+            'executable: "../first/index", mainPack: "index.pck",',
+        )
+
+    def test_custom_start_game_on_one_line(self) -> None:
+        html = "engine.startGame({executable: 'game', mainPack: 'game.pck'});"
+        lines, results = self.rewrite(html)
+        self.assertEqual(results, [None, "game", None])
+        self.assertEqual(
+            lines,
+            [
+                "engine.startGame({executable: \"../first/index\", mainPack: 'game.pck'});"
+            ],
+        )
+
+    def test_executable_outside_start_game_ignored(self) -> None:
+        html = "engine.startGame({onProgress: f});\nconst options = {executable: 'x'};"
+        _, results = self.rewrite(html)
+        self.assertEqual(results, [None, None, None])
+
+
+class TestGodotDeduplicatorVersions(GodotBuilds):
+    def test_godot32_build_loads_kept_engine(self) -> None:
+        first = self.build("first", files={"index.html": GODOT32_HTML.encode()})
+        second = self.build("second", files={"index.html": GODOT32_HTML.encode()})
+        self.add(first, (0,))
+        self.add(second, (1,))
+
+        self.assertFalse(second.exists())
+        self.assertFalse((second.parent / "index.js").exists())
+        html = (second.parent / "index.html").read_text()
+        self.assertIn('const EXECUTABLE_NAME = "../first/index";', html)
+        self.assertIn('src="../first/index.js"', html)
+        self.assertIn("const MAIN_PACK = 'index.pck';", html)
+
+    def test_godot35_build_loads_kept_engine(self) -> None:
+        first = self.build("first", files={"index.html": GODOT35_HTML.encode()})
+        second = self.build("second", files={"index.html": GODOT35_HTML.encode()})
+        self.add(first, (0,))
+        self.add(second, (1,))
+
+        self.assertFalse(second.exists())
+        lines = (second.parent / "index.html").read_text().splitlines()
+        self.assertEqual(godot_config(lines)["executable"], "../first/index")
+
+
+class TestFileSharer(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dest_dir = pathlib.Path(tmp.name)
+        self.sharer = FileSharer(
+            self.dest_dir, SharingConfig(min_size=1024), HashCache(None)
+        )
+
+    def write(self, path: str, data: str | bytes) -> None:
+        full_path = self.dest_dir / path
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(data, str):
+            full_path.write_text(data)
+        else:
+            full_path.write_bytes(data)
+
+    def test_reference(self) -> None:
+        reference = FileSharer.reference("assets/big.bin")
+        for text in [
+            '<img src="assets/big.bin">',
+            "<img src='./assets/big.bin'>",
+            "background: url(assets/big.bin)",
+            'fetch("assets/big.bin?v=2")',
+            'fetch("assets/big.bin#part")',
+        ]:
+            with self.subTest(text=text):
+                self.assertIsNotNone(reference.search(text))
+        for text in [
+            '<img src="other/assets/big.bin">',
+            '<img src="assets/big.bin.map">',
+            "assets/big.bin",
+        ]:
+            with self.subTest(text=text):
+                self.assertIsNone(reference.search(text))
+
+    def test_share(self) -> None:
+        big = b"X" * 2048
+        builds = {}
+        for site_path in ["branches/o/a", "branches/o/b"]:
+            self.write(f"{site_path}/assets/big.bin", big)
+            self.write(f"{site_path}/assets/other.bin", big)
+            self.write(f"{site_path}/index.html", '<img src="assets/big.bin">')
+            self.write(f"{site_path}/css/style.css", "a { b: url(../assets/big.bin) }")
+            # Scripts' URLs are resolved against the page, not the script
+            self.write(f"{site_path}/js/load.js", "fetch('assets/big.bin')")
+            builds[site_path] = [
+                "assets/big.bin",
+                "assets/other.bin",
+                "index.html",
+                "css/style.css",
+                "js/load.js",
+            ]
+
+        removed = self.sharer.share(builds)
+
+        shared = f"{SHARED_DIR}/{hashlib.sha256(big).hexdigest()}/big.bin"
+        self.assertEqual(
+            sorted(removed),
+            [("branches/o/a", "assets/big.bin"), ("branches/o/b", "assets/big.bin")],
+        )
+        self.assertEqual((self.dest_dir / shared).read_bytes(), big)
+        self.assertEqual(self.sharer.shared_bytes, len(big))
+        for site_path in builds:
+            build_dir = self.dest_dir / site_path
+            self.assertFalse((build_dir / "assets/big.bin").exists())
+            # Not referenced anywhere, so left in place
+            self.assertTrue((build_dir / "assets/other.bin").exists())
+            self.assertEqual(
+                (build_dir / "index.html").read_text(),
+                f'<img src="../../../{shared}">',
+            )
+            self.assertEqual(
+                (build_dir / "css/style.css").read_text(),
+                f"a {{ b: url(../../../../{shared}) }}",
+            )
+            self.assertEqual(
+                (build_dir / "js/load.js").read_text(),
+                f"fetch('../../../{shared}')",
+            )
+
+    def test_unique_files_are_not_shared(self) -> None:
+        self.write("a/big.bin", b"A" * 2048)
+        self.write("a/index.html", '<img src="big.bin">')
+        self.write("b/big.bin", b"B" * 2048)
+        self.write("b/index.html", '<img src="big.bin">')
+
+        removed = self.sharer.share(
+            {"a": ["big.bin", "index.html"], "b": ["big.bin", "index.html"]}
+        )
+
+        self.assertEqual(removed, [])
+        self.assertFalse((self.dest_dir / SHARED_DIR).exists())
+
+    def test_scripts_shared(self) -> None:
+        three = "/* three.js */" + " " * 4096
+        builds = {}
+        for site_path in ["a", "b"]:
+            self.write(f"{site_path}/vendor/three.min.js", three)
+            self.write(
+                f"{site_path}/index.html", '<script src="vendor/three.min.js"></script>'
+            )
+            builds[site_path] = ["vendor/three.min.js", "index.html"]
+
+        removed = self.sharer.share(builds)
+
+        shared = (
+            f"{SHARED_DIR}/{hashlib.sha256(three.encode()).hexdigest()}/three.min.js"
+        )
+        self.assertEqual(
+            sorted(removed),
+            [("a", "vendor/three.min.js"), ("b", "vendor/three.min.js")],
+        )
+        self.assertEqual((self.dest_dir / shared).read_text(), three)
+        for site_path in builds:
+            self.assertEqual(
+                (self.dest_dir / site_path / "index.html").read_text(),
+                f'<script src="../{shared}"></script>',
+            )
+
+    def test_rewritten_scripts_stay(self) -> None:
+        big = b"X" * 2048
+        loader = "fetch('big.bin');" + " " * 2048
+        builds = {}
+        for site_path in ["a", "b/c"]:
+            self.write(f"{site_path}/big.bin", big)
+            self.write(f"{site_path}/loader.js", loader)
+            self.write(f"{site_path}/index.html", '<script src="loader.js"></script>')
+            builds[site_path] = ["big.bin", "loader.js", "index.html"]
+
+        removed = self.sharer.share(builds)
+
+        # The scripts now refer to the shared file by different paths
+        self.assertEqual(sorted(removed), [("a", "big.bin"), ("b/c", "big.bin")])
+        for site_path in builds:
+            self.assertIn(
+                SHARED_DIR, (self.dest_dir / site_path / "loader.js").read_text()
+            )
+            self.assertEqual(
+                (self.dest_dir / site_path / "index.html").read_text(),
+                '<script src="loader.js"></script>',
+            )
+
+    def test_stylesheets_referring_to_their_build_stay(self) -> None:
+        style = "a { b: url(font.woff) }" + " " * 2048
+        plain = "a { b: c }" + " " * 2048
+        builds = {}
+        for site_path in ["a", "b"]:
+            self.write(f"{site_path}/css/style.css", style)
+            self.write(f"{site_path}/css/plain.css", plain)
+            self.write(f"{site_path}/css/font.woff", b"font")
+            self.write(
+                f"{site_path}/index.html",
+                '<link href="css/style.css"><link href="css/plain.css">',
+            )
+            builds[site_path] = [
+                "css/style.css",
+                "css/plain.css",
+                "css/font.woff",
+                "index.html",
+            ]
+
+        removed = self.sharer.share(builds)
+
+        # Its reference to font.woff would break if it moved
+        self.assertEqual(
+            sorted(removed), [("a", "css/plain.css"), ("b", "css/plain.css")]
+        )
+        for site_path in builds:
+            self.assertTrue((self.dest_dir / site_path / "css/style.css").exists())
+
+    def test_scripts_referred_to_from_shared_scripts_stay(self) -> None:
+        first = "import('second.js');" + " " * 2048
+        second = "// second" + " " * 2048
+        builds = {}
+        for site_path in ["a", "b"]:
+            self.write(f"{site_path}/first.js", first)
+            self.write(f"{site_path}/second.js", second)
+            self.write(f"{site_path}/index.html", '<script src="first.js"></script>')
+            builds[site_path] = ["first.js", "second.js", "index.html"]
+
+        removed = self.sharer.share(builds)
+
+        # The shared copy of first.js still refers to second.js by its path
+        # in the build, so second.js must stay.
+        self.assertEqual(sorted(removed), [("a", "first.js"), ("b", "first.js")])
+        for site_path in builds:
+            self.assertTrue((self.dest_dir / site_path / "second.js").exists())
+
+
+class TestGodotDeduplicatorDeferred(GodotBuilds):
+    sha256 = hashlib.sha256(ENGINE).hexdigest()
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.restored: list[pathlib.Path] = []
+
+    def defer_replaced(
+        self, name: str, target: pathlib.Path, rank: tuple
+    ) -> pathlib.Path:
+        """Lays out a build which a previous run deduplicated against target,
+        and defers it."""
+        path = self.build(name)
+        html = GODOT4_HTML.replace(
+            '"executable":"index"', '"executable":"../first/index"'
+        )
+        (path.parent / "index.html").write_text(html)
+        path.unlink()
+
+        def restore() -> None:
+            self.restored.append(path)
+            path.write_bytes(ENGINE)
+            (path.parent / "index.html").write_text(GODOT4_HTML)
+
+        self.deduplicator.defer(
+            path,
+            rank,
+            len(ENGINE),
+            zlib.crc32(ENGINE),
+            self.sha256,
+            target,
+            1234,
+            restore,
+        )
+        return path
+
+    def test_still_loading_kept_copy(self) -> None:
+        first = self.build("first")
+        second = self.defer_replaced("second", first, (1,))
+        self.add(first, (0,))
+        self.deduplicator.finish()
+
+        self.assertEqual(self.restored, [])
+        self.assertFalse(second.exists())
+        self.assertEqual(self.deduplicator.deduplicated_bytes, 1234)
+        self.assertEqual(
+            self.deduplicator.state(self.dest_dir)["second/index.wasm"]["target"],
+            "first/index.wasm",
+        )
+
+    def test_restored_when_kept_copy_moves(self) -> None:
+        first = self.dest_dir / "first" / "index.wasm"
+        second = self.defer_replaced("second", first, (1,))
+        # This time, first is not published, and a better-ranked build is
+        zeroth = self.build("zeroth")
+        self.add(zeroth, (0,))
+        self.deduplicator.finish()
+
+        self.assertEqual(self.restored, [second])
+        self.assertFalse(second.exists())
+        self.assertEqual(self.config(second.parent)["executable"], "../zeroth/index")
+        self.assertEqual(
+            self.deduplicator.state(self.dest_dir)["second/index.wasm"]["target"],
+            "zeroth/index.wasm",
+        )
+
+    def test_restored_copy_kept_when_best_ranked(self) -> None:
+        first = self.dest_dir / "first" / "index.wasm"
+        second = self.defer_replaced("second", first, (1,))
+        third = self.build("third")
+        self.add(third, (2,))
+        self.deduplicator.finish()
+
+        self.assertEqual(self.restored, [second])
+        self.assertTrue(second.exists())
+        self.assertEqual(self.config(second.parent)["executable"], "index")
+        self.assertFalse(third.exists())
+        self.assertEqual(self.config(third.parent)["executable"], "../second/index")
+
+
+class TestSiteManifest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = pathlib.Path(tmp.name) / "_build.json"
+
+    def test_round_trip(self) -> None:
+        manifest = SiteManifest(
+            builds={".": "digest-sha256-a", "branches/o/dev": "artifact-2"},
+            files={".": ["index.html", "index.wasm"], "branches/o/dev": ["a/b.png"]},
+            wasms={
+                "branches/o/dev/index.wasm": {
+                    "size": 10,
+                    "crc32": 1234,
+                    "sha256": None,
+                    "target": "index.wasm",
+                }
+            },
+            shared=["branches/o/dev"],
+            aliases={"branches/f/x": "."},
+        )
+        manifest.dump(self.path)
+        self.assertEqual(SiteManifest.load(self.path), manifest)
+
+    def test_missing(self) -> None:
+        self.assertIsNone(SiteManifest.load(self.path))
+
+    def test_unreadable(self) -> None:
+        for content in ['{"builds": ', '{"unknown": {}}', "[]"]:
+            with self.subTest(content=content):
+                self.path.write_text(content)
+                with self.assertLogs(level="WARNING"):
+                    self.assertIsNone(SiteManifest.load(self.path))
+
+
+class TestExtractHashing(unittest.TestCase):
+    def test_extracts_and_hashes_member(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = pathlib.Path(tmp) / "build.zip"
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+                zip_file.writestr("index.wasm", ENGINE)
+            dest = pathlib.Path(tmp) / "index.wasm"
+            with zipfile.ZipFile(archive) as zip_file:
+                extracted, sha256_hash = extract_hashing(
+                    zip_file, zip_file.getinfo("index.wasm"), dest
+                )
+            self.assertEqual(extracted.parent, dest.parent)
+            self.assertEqual(extracted.read_bytes(), ENGINE)
+            self.assertEqual(sha256_hash, hashlib.sha256(ENGINE).hexdigest())
+            self.assertFalse(dest.exists())
+
+
+def make_zip(files: dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in files.items():
+            zip_file.writestr(name, data)
+    return buffer.getvalue()
+
+
+class TestDownloadZip(unittest.TestCase):
+    url = f"{API}/repos/owner/game/actions/artifacts/1/zip"
+
+    def setUp(self) -> None:
+        noise = random.Random(0)
+        # Incompressible, so that the archive is larger than the tail fetched
+        # with its central directory
+        self.files = {
+            "index.html": GODOT4_HTML.encode(),
+            "index.wasm": noise.randbytes(200_000),
+            "index.js": noise.randbytes(1_000),
+            "index.pck": noise.randbytes(200_000),
+        }
+        self.archive = make_zip(self.files)
+        self.supports_ranges = True
+        self.api, self.transport = fake_api(self.handle)
+
+    def handle(self, request: requests.PreparedRequest) -> tuple[int, Any, dict]:
+        range_header = request.headers.get("Range")
+        if range_header is None or not self.supports_ranges:
+            return 200, self.archive, {}
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header)
+        assert match is not None
+        total = len(self.archive)
+        if match[1]:
+            start, end = int(match[1]), int(match[2]) + 1
+        else:
+            start, end = max(total - int(match[2]), 0), total
+        content_range = f"bytes {start}-{end - 1}/{total}"
+        return 206, self.archive[start:end], {"Content-Range": content_range}
+
+    def download(self, *skip: str) -> tuple[bytes, set[str]]:
+        f, skipped = self.api.download_zip(
+            self.url, None, lambda member: member.filename in skip
+        )
+        with f:
+            return f.read(), skipped
+
+    def ranges(self) -> list[str | None]:
+        return [request.headers.get("Range") for request in self.transport.sent]
+
+    def test_skipped_member_not_fetched(self) -> None:
+        data, skipped = self.download("index.wasm")
+        self.assertEqual(skipped, {"index.wasm"})
+
+        with zipfile.ZipFile(io.BytesIO(self.archive)) as zip_file:
+            wasm, js = zip_file.getinfo("index.wasm"), zip_file.getinfo("index.js")
+        total = len(self.archive)
+        tail_start = total - ZIP_TAIL_SIZE
+        # The tail, then everything before the engine, then everything after
+        # it up to the tail, in one range since nothing between is skipped
+        self.assertEqual(
+            self.ranges(),
+            [
+                f"bytes=-{ZIP_TAIL_SIZE}",
+                f"bytes=0-{wasm.header_offset - 1}",
+                f"bytes={js.header_offset}-{tail_start - 1}",
+            ],
+        )
+        # The token is not sent to the server the archive is redirected to
+        for request in self.transport.sent[1:]:
+            self.assertNotIn("Authorization", request.headers)
+
+        self.assertEqual(len(data), total)
+        self.assertEqual(data[: wasm.header_offset], self.archive[: wasm.header_offset])
+        self.assertEqual(data[js.header_offset :], self.archive[js.header_offset :])
+        self.assertEqual(
+            data[wasm.header_offset : js.header_offset].count(0),
+            js.header_offset - wasm.header_offset,
+        )
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            for name in ("index.html", "index.js", "index.pck"):
+                self.assertEqual(zip_file.read(name), self.files[name])
+
+    def test_nothing_to_skip_downloads_whole_archive(self) -> None:
+        data, skipped = self.download()
+        self.assertEqual(skipped, set())
+        self.assertEqual(data, self.archive)
+        self.assertEqual(self.ranges(), [f"bytes=-{ZIP_TAIL_SIZE}", None])
+
+    def test_without_range_support_downloads_whole_archive(self) -> None:
+        self.supports_ranges = False
+        data, skipped = self.download("index.wasm")
+        self.assertEqual(skipped, set())
+        self.assertEqual(data, self.archive)
+        self.assertEqual(self.ranges(), [f"bytes=-{ZIP_TAIL_SIZE}", None])
+
+    def test_small_archive_fetched_with_tail(self) -> None:
+        self.files["index.wasm"] = ENGINE
+        self.files["index.pck"] = b"pck"
+        self.archive = make_zip(self.files)
+        data, skipped = self.download("index.wasm")
+        self.assertEqual(skipped, set())
+        self.assertEqual(data, self.archive)
+        self.assertEqual(self.ranges(), [f"bytes=-{ZIP_TAIL_SIZE}"])
+
+    def test_listed_from_archive_tail(self) -> None:
+        self.assertEqual(self.api.list_zip(self.url), members_of(self.files))
+        self.assertEqual(self.ranges(), [f"bytes=-{ZIP_TAIL_SIZE}"])
+
+    def test_not_listed_without_range_support(self) -> None:
+        self.supports_ranges = False
+        self.assertIsNone(self.api.list_zip(self.url))
+
+
+def members_of(files: dict[str, bytes]) -> dict[str, Member]:
+    return {name: Member(len(data), zlib.crc32(data)) for name, data in files.items()}
+
+
+class TestZipMembers(unittest.TestCase):
+    files = {
+        "index.html": b"<html></html>",
+        "index.wasm": ENGINE,
+        "assets/": b"",
+        "assets/data.bin": bytes(range(256)) * 64,
+    }
+
+    def test_whole_archive(self) -> None:
+        self.assertEqual(zip_members(make_zip(self.files)), members_of(self.files))
+
+    def test_central_directory_only(self) -> None:
+        data = make_zip(self.files)
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            end = max(
+                member.header_offset + len(member.FileHeader()) + member.compress_size
+                for member in zip_file.infolist()
+            )
+        self.assertEqual(zip_members(data[end:]), members_of(self.files))
+
+    def test_truncated_central_directory(self) -> None:
+        self.assertIsNone(zip_members(make_zip(self.files)[-40:]))
+
+    def test_not_a_zip(self) -> None:
+        self.assertIsNone(zip_members(b"not a zip archive"))
+
+
+class TestSitePlanner(unittest.TestCase):
+    build = {
+        "index.html": b"<html></html>",
+        "index.pck": b"pck" * 10,
+        "index.wasm": ENGINE,
+        "index.js": b"js" * 10,
+    }
+
+    def test_archive_size(self) -> None:
+        planner = SitePlanner(1000, None)
+        self.assertIsNone(planner.admit(600, "artifact-1", None))
+        reason = planner.admit(600, "artifact-2", None)
+        self.assertEqual(reason, "it would take the site over its size budget of 0 MiB")
+        self.assertEqual(planner.planned_bytes, 600)
+
+    def test_force(self) -> None:
+        planner = SitePlanner(1000, None)
+        self.assertIsNone(planner.admit(1500, "asset-1", None, force=True))
+        self.assertIsNotNone(planner.admit(1, "artifact-2", None))
+        self.assertEqual(planner.planned_bytes, 1500)
+
+    def test_identical_builds(self) -> None:
+        planner = SitePlanner(1000, None)
+        self.assertIsNone(planner.admit(600, "digest-a", "sha256:a"))
+        self.assertIsNone(planner.admit(600, "digest-a", "sha256:a"))
+        self.assertEqual(planner.planned_bytes, 600)
+
+    def test_listed_engine_counted_once(self) -> None:
+        listed = members_of(self.build)
+        total = sum(member.size for member in listed.values())
+        engine = listed["index.wasm"].size + listed["index.js"].size
+        planner = SitePlanner(2 * total - engine, None)
+
+        self.assertIsNone(planner.admit(1, "artifact-1", None, listed=listed))
+        self.assertIsNone(planner.admit(1, "artifact-2", None, listed=listed))
+        self.assertEqual(planner.planned_bytes, 2 * total - engine)
+        self.assertIsNotNone(planner.admit(1, "artifact-3", None))
+
+    def test_stored_members_preferred(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = BuildStore(pathlib.Path(tmp.name))
+
+        def extract(dest_dir: pathlib.Path) -> dict[str, Member]:
+            for name, data in self.build.items():
+                (dest_dir / name).write_bytes(data)
+            return members_of(self.build)
+
+        store.put("artifact-1", extract)
+        planner = SitePlanner(10_000, store)
+
+        self.assertIsNone(
+            planner.admit(1, "artifact-1", None, listed={"x": Member(5000, 0)})
+        )
+        self.assertEqual(
+            planner.planned_bytes, sum(len(data) for data in self.build.values())
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()